@@ -0,0 +1,69 @@
+"""
+Measures counter increments under contention from 64 threads.
+
+It compares the sharded CounterStore with every counter behind one global
+lock, once with each thread updating its own counter and once with all
+of them updating the same counter, and checks that no increment is lost.
+
+Usage (from the 06_TDD_case_study directory):
+    python benchmarks/bench_counters.py [increments_per_thread]
+"""
+import os
+import sys
+import time
+from threading import Barrier, Thread
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from counter import CounterStore  # noqa: E402
+
+THREADS = 64
+
+
+class GlobalLockStore(CounterStore):
+    """Every counter in one shard behind one lock, for comparison."""
+
+    def __init__(self):
+        super().__init__(shard_count=1)
+
+
+def increments_per_second(store, names, count):
+    """Runs one thread per name, each incrementing its counter count times."""
+    for name in set(names):
+        store.create(name)
+    start = Barrier(len(names) + 1)
+
+    def update(name):
+        start.wait()
+        for _ in range(count):
+            store.increment(name)
+
+    threads = [Thread(target=update, args=(name,)) for name in names]
+    for thread in threads:
+        thread.start()
+    start.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    expected = {name: 1 + count * names.count(name) for name in set(names)}
+    lost = sum(expected[name] - store.get(name) for name in expected)
+    return len(names) * count / elapsed, lost
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    workloads = {
+        'one counter per thread': [f"counter-{n}" for n in range(THREADS)],
+        'one shared counter': ['counter'] * THREADS,
+    }
+    print(f"{THREADS} threads, {count:,} increments each")
+    for workload, names in workloads.items():
+        print(f"  {workload}:")
+        for label, store in (('global lock', GlobalLockStore()), ('sharded', CounterStore())):
+            rate, lost = increments_per_second(store, names, count)
+            print(f"    {label:<12} {rate:12,.0f} increments/s, {lost} lost")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,49 +1,89 @@
+from threading import Lock
 from flask import Flask
 import status
 
 app = Flask(__name__)
 
-COUNTERS = {}
+# Number of independently locked shards the counters are spread over
+SHARD_COUNT = 64
+
+class CounterStore:
+    """
+    Counters spread over shards by the hash of their name.
+
+    Every shard has its own lock, so requests for counters in different
+    shards never wait for each other, while each check-and-change on one
+    counter happens under its shard's lock and no increment is lost.
+    """
+
+    def __init__(self, shard_count=SHARD_COUNT):
+        self.shards = [({}, Lock()) for _ in range(shard_count)]
+
+    def shard(self, name):
+        return self.shards[hash(name) % len(self.shards)]
+
+    def create(self, name):
+        """Creates a counter at 1, returning None if it already exists"""
+        counters, lock = self.shard(name)
+        with lock:
+            if name in counters:
+                return None
+            counters[name] = 1
+            return 1
+
+    def increment(self, name):
+        """Adds 1 to a counter, returning its new value or None if it does not exist"""
+        counters, lock = self.shard(name)
+        with lock:
+            if name not in counters:
+                return None
+            counters[name] += 1
+            return counters[name]
+
+    def get(self, name):
+        """Returns the value of a counter, or None if it does not exist"""
+        counters, _ = self.shard(name)
+        return counters.get(name)
+
+    def delete(self, name):
+        """Deletes a counter, returning whether it existed"""
+        counters, lock = self.shard(name)
+        with lock:
+            return counters.pop(name, None) is not None
+
+COUNTERS = CounterStore()
 
 @app.route("/counters/<name>", methods=["POST"])
 def create_counter(name):
     """Creates a counter"""
-    global COUNTERS
-    
-    if name in COUNTERS:
+    value = COUNTERS.create(name)
+    if value is None:
         return {}, status.HTTP_409_CONFLICT
-    
-    COUNTERS[name] = 1
-    return {name: COUNTERS[name]}, status.HTTP_201_CREATED
+
+    return {name: value}, status.HTTP_201_CREATED
 
 @app.route("/counters/<name>", methods=["PUT"])
 def update_counter(name):
     """Updates a counter"""
-    global COUNTERS
-    
-    if name not in COUNTERS:
+    value = COUNTERS.increment(name)
+    if value is None:
         return {}, status.HTTP_404_NOT_FOUND
-    
-    COUNTERS[name] += 1
-    return {name: COUNTERS[name]}, status.HTTP_200_OK
+
+    return {name: value}, status.HTTP_200_OK
 
 @app.route("/counters/<name>", methods=["GET"])
 def read_counter(name):
     """Reads a counter"""
-    global COUNTERS
-    
-    if name not in COUNTERS:
+    value = COUNTERS.get(name)
+    if value is None:
         return {}, status.HTTP_404_NOT_FOUND
-    
-    return {name: COUNTERS[name]}, status.HTTP_200_OK
+
+    return {name: value}, status.HTTP_200_OK
 
 @app.route("/counters/<name>", methods=["DELETE"])
 def delete_counter(name):
     """Deletes a counter"""
-    global COUNTERS
-    
-    if name not in COUNTERS:
+    if not COUNTERS.delete(name):
         return {}, status.HTTP_404_NOT_FOUND
-    
-    del COUNTERS[name]
-    return {}, status.HTTP_200_OK
\ No newline at end of file
+
+    return {}, status.HTTP_200_OK
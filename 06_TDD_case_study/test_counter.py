@@ -1,9 +1,10 @@
 """
 Test Cases for Counter Web Service
 """
+from threading import Thread
 from unittest import TestCase
 import status
-from counter import app
+from counter import app, CounterStore
 
 class CounterTest(TestCase):
     """Test Cases for Counter Web Service"""
@@ -64,4 +65,23 @@ class CounterTest(TestCase):
         
     def test_delete_counter_failed(self):
         response = self.client.delete("/counters/test-counter-7")
-        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
\ No newline at end of file
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_concurrent_updates(self):
+        store = CounterStore(shard_count=4)
+        names = [f"counter-{n}" for n in range(8)]
+        for name in names:
+            store.create(name)
+
+        def update(name):
+            for _ in range(1000):
+                store.increment(name)
+
+        threads = [Thread(target=update, args=(name,)) for name in names * 4]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for name in names:
+            self.assertEqual(store.get(name), 4001)
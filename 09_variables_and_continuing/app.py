@@ -8,11 +8,11 @@ next_id = 1
 app = Flask(__name__)
 
 # Helper function to generate a unique ID
-def get_next_id():
-    """Generates a unique ID for a new pet."""
+def get_next_id(count=1):
+    """Reserves count consecutive IDs and returns the first one."""
     global next_id
     current_id = next_id
-    next_id += 1
+    next_id += count
     return current_id
 
 # Route for the homepage
@@ -47,6 +47,24 @@ def handle_pets():
         
         return jsonify(list(pets.values()))
 
+# API endpoint to create many pets in one request
+@app.route('/pets/batch', methods=['POST'])
+def create_pets():
+    """
+    Creates every pet in a JSON array and returns their IDs.
+    """
+    new_pets = request.get_json()
+    if not isinstance(new_pets, list) or not all(isinstance(pet, dict) for pet in new_pets):
+        return jsonify({"message": "Expected a JSON array of pets"}), 400
+
+    first_id = get_next_id(len(new_pets))
+    for new_id, new_pet in enumerate(new_pets, start=first_id):
+        new_pet['id'] = new_id
+        pets[new_id] = new_pet
+    response_data = jsonify({"ids": [pet['id'] for pet in new_pets]})
+    response_data.status_code = 201
+    return response_data
+
 # API endpoint for updating a pet
 @app.route('/pets/<int:pet_id>', methods=['PUT'])
 def update_pet(pet_id):
@@ -13,16 +13,17 @@ def step_impl(context):
     """ Reset database and load data from feature file """
     requests.post(f"{context.base_url}/pets/reset")
     
+    results = []
     for row in context.table:
-        result = {
+        results.append({
             "name": row['name'],
             "category": row['category'],
             "available": row['available'] in ['True', 'true', '1'],
             "gender": row['gender'],
             "birthday": row['birthday']
-        }
-        response = requests.post(f"{context.base_url}/pets", json=result)
-        assert(response.status_code == 201)
+        })
+    response = requests.post(f"{context.base_url}/pets/batch", json=results)
+    assert(response.status_code == 201)
 
 @given('I am on the "Home Page"')
 def step_impl(context):
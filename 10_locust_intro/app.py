@@ -1,16 +1,27 @@
 # app.py
 from flask import Flask, render_template, jsonify
+from metrics import MetricsMiddleware
 
 app = Flask(__name__)
 
 # A simple in-memory counter
 hit_counter = 0
 
+# Per-route latency histograms, requests in flight and the counter at /metrics
+app.wsgi_app = MetricsMiddleware(app.wsgi_app, gauges={'hit_counter': lambda: hit_counter})
+
+# The homepage is rendered once with this marker in place of the counter,
+# then every hit only joins the two halves around the current count
+COUNTER_MARKER = '@@counter@@'
+home_page_parts = None
+
 @app.route('/')
 def home():
     """Serves the homepage with the hit counter."""
-    global hit_counter
-    return render_template('index.html', counter=hit_counter)
+    global home_page_parts
+    if home_page_parts is None:
+        home_page_parts = render_template('index.html', counter=COUNTER_MARKER).split(COUNTER_MARKER)
+    return str(hit_counter).join(home_page_parts)
 
 @app.route('/hit', methods=['POST'])
 def hit():
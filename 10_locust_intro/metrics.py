@@ -0,0 +1,173 @@
+# metrics.py
+"""
+Server-side request metrics, exposed at /metrics in Prometheus text format.
+
+Load tests measure latency from the client, where server time and network
+time look the same.  MetricsMiddleware wraps any WSGI application and
+records, for every route, method and status, a histogram of the time the
+application took to start its response.  It also tells each client that
+time in a Server-Timing header.
+"""
+import itertools
+import threading
+import time
+
+# Each power of two is split into 2**SUB_BUCKET_BITS buckets, so a
+# recorded latency is at most 1/2**SUB_BUCKET_BITS (25%) above the real one
+SUB_BUCKET_BITS = 2
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+
+# Latencies are recorded in microseconds, up to 2**27 us (about 134 s)
+MAX_MICROS = (1 << 27) - 1
+
+
+def bucket_index(micros):
+    """Returns the HDR-style bucket of a latency in whole microseconds."""
+    if micros > MAX_MICROS:
+        micros = MAX_MICROS
+    shift = micros.bit_length() - SUB_BUCKET_BITS - 1
+    if shift <= 0:
+        return micros
+    return (shift << SUB_BUCKET_BITS) + (micros >> shift)
+
+def bucket_upper_bound(index):
+    """Returns the exclusive upper bound, in microseconds, of a bucket."""
+    if index < 2 * SUB_BUCKETS:
+        return index + 1
+    shift = (index >> SUB_BUCKET_BITS) - 1
+    return ((index & (SUB_BUCKETS - 1)) + SUB_BUCKETS + 1) << shift
+
+def server_timing(nanoseconds):
+    """Returns the Server-Timing header for a response that took this long."""
+    return f"app;dur={nanoseconds / 1e6:.3f}"
+
+BUCKET_COUNT = bucket_index(MAX_MICROS) + 1
+
+# The le label of every bucket, in seconds
+BUCKET_BOUNDS = [f"{bucket_upper_bound(index) / 1e6:g}" for index in range(BUCKET_COUNT)]
+
+
+class MetricsMiddleware:
+    """
+    Records per-route latency histograms and serves them at path.
+
+    The route is the URL rule Flask matched (like /pets/<int:pet_id>), so
+    every pet shares one series; requests that match no rule are counted
+    under "unmatched".  Gauges maps metric names to functions whose value
+    is read when the metrics are scraped, such as the number of pets.
+    A streamed response counts until the client has read all of it for
+    requests in flight, but its latency is the time to its first byte.
+    Servers that are not WSGI report their requests with request_started(),
+    record() and request_finished() instead.
+    """
+
+    def __init__(self, app, gauges=None, path='/metrics'):
+        self.app = app
+        self.gauges = gauges or {}
+        self.path = path
+        self._series = {}       # (route, method, status) -> [bucket counts, total ns]
+        self._lock = threading.Lock()
+        self._started = itertools.count()
+        self._finished = itertools.count()
+
+    def __call__(self, environ, start_response):
+        if environ.get('PATH_INFO') == self.path:
+            return self.serve_metrics(start_response)
+
+        next(self._started)
+        started = time.perf_counter_ns()
+
+        def timed_start_response(status, headers, exc_info=None):
+            elapsed = time.perf_counter_ns() - started
+            headers.append(('Server-Timing', server_timing(elapsed)))
+            request = environ.get('werkzeug.request')
+            rule = getattr(request, 'url_rule', None)
+            self.record(rule.rule if rule is not None else 'unmatched',
+                        environ.get('REQUEST_METHOD'), status[:3], elapsed)
+            return start_response(status, headers, exc_info)
+
+        try:
+            body = self.app(environ, timed_start_response)
+        except BaseException:
+            self.request_finished()
+            raise
+        return FinishedOnClose(body, self._finished)
+
+    def record(self, route, method, status, nanoseconds):
+        """Adds one request to the histogram of its series."""
+        key = (route, method, status)
+        index = bucket_index(nanoseconds // 1000)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * BUCKET_COUNT, 0]
+            series[0][index] += 1
+            series[1] += nanoseconds
+
+    def request_started(self):
+        next(self._started)
+
+    def request_finished(self):
+        next(self._finished)
+
+    @property
+    def in_flight(self):
+        """Requests started but not finished yet."""
+        # Reading a count advances it, but both advance by one, so the difference holds
+        return next(self._started) - next(self._finished)
+
+    def render(self):
+        """Returns every metric in Prometheus text format."""
+        with self._lock:
+            series = [(key, list(counts), total) for key, (counts, total) in sorted(self._series.items())]
+        lines = [
+            '# HELP http_request_duration_seconds Time until the application started its response.',
+            '# TYPE http_request_duration_seconds histogram',
+        ]
+        for (route, method, status), counts, total in series:
+            labels = f'route="{route}",method="{method}",status="{status}"'
+            cumulative = 0
+            for bound, count in zip(BUCKET_BOUNDS, counts):
+                cumulative += count
+                lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {cumulative}')
+            lines.append(f'http_request_duration_seconds_sum{{{labels}}} {total / 1e9}')
+            lines.append(f'http_request_duration_seconds_count{{{labels}}} {cumulative}')
+        lines += [
+            '# HELP http_requests_in_flight Requests being handled, including unfinished streams.',
+            '# TYPE http_requests_in_flight gauge',
+            f'http_requests_in_flight {self.in_flight}',
+        ]
+        for name, read in self.gauges.items():
+            lines += [f'# TYPE {name} gauge', f'{name} {read()}']
+        return '\n'.join(lines) + '\n'
+
+    def serve_metrics(self, start_response):
+        body = self.render().encode()
+        start_response('200 OK', [('Content-Type', 'text/plain; version=0.0.4; charset=utf-8'),
+                                  ('Content-Length', str(len(body)))])
+        return [body]
+
+
+class FinishedOnClose:
+    """
+    Passes a response body through and counts its request as finished once
+    the server closes it.  The server iterates the body itself, so this
+    adds nothing per chunk.
+    """
+
+    __slots__ = ('body', 'finished')
+
+    def __init__(self, body, finished):
+        self.body = body
+        self.finished = finished
+
+    def __iter__(self):
+        return iter(self.body)
+
+    def close(self):
+        try:
+            if hasattr(self.body, 'close'):
+                self.body.close()
+        finally:
+            next(self.finished)
@@ -1,10 +1,30 @@
 from flask import Flask, jsonify, request, render_template, make_response
+from os import getenv
+from admission import CHEAP, EXPENSIVE, AdmissionController
 
 pets = {}
 next_id = 1
 
 app = Flask(__name__)
 
+# The homepage does not depend on the pets, so it is rendered only once
+home_page = None
+
+def classify_request(environ):
+    """Full listings of every pet are expensive; everything else is a cheap request."""
+    if (environ.get('PATH_INFO') == '/pets' and environ.get('REQUEST_METHOD') == 'GET'
+            and 'category=' not in environ.get('QUERY_STRING', '')):
+        return EXPENSIVE
+    return CHEAP
+
+# At most PETSHOP_MAX_CONCURRENT requests (default 32) run at once.  The rest
+# wait up to PETSHOP_QUEUE_TIMEOUT_MS (default 500) for a turn, cheap ones
+# first, and are then turned away with 503 and Retry-After
+app.wsgi_app = AdmissionController(
+    app.wsgi_app, classify_request,
+    max_concurrent=int(getenv('PETSHOP_MAX_CONCURRENT', '32')),
+    queue_timeout=int(getenv('PETSHOP_QUEUE_TIMEOUT_MS', '500')) / 1000)
+
 def get_next_id():
     """Generates a unique ID for a new pet."""
     global next_id
@@ -15,7 +35,10 @@ def get_next_id():
 @app.route('/')
 def home():
     """Serves the homepage for the app."""
-    return render_template('index.html')
+    global home_page
+    if home_page is None:
+        home_page = render_template('index.html')
+    return home_page
 
 @app.route('/pets', methods=['GET', 'POST'])
 def handle_pets():
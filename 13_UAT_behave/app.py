@@ -5,6 +5,10 @@ next_id = 1
 
 app = Flask(__name__)
 
+# The homepage does not depend on the pets (the page fetches them itself),
+# so it is rendered only once
+home_page = None
+
 def get_next_id():
     """Generates a unique ID for a new pet."""
     global next_id
@@ -15,7 +19,10 @@ def get_next_id():
 @app.route('/')
 def home():
     """Serves the homepage for the app."""
-    return render_template('index.html', pets=list(pets.values()))
+    global home_page
+    if home_page is None:
+        home_page = render_template('index.html')
+    return home_page
 
 @app.route('/pets', methods=['GET', 'POST'])
 def handle_pets():
@@ -0,0 +1,168 @@
+# admission.py
+"""
+Admission control for the pet shop.
+
+Past a certain number of concurrent requests, taking on more only makes
+every request slower, until they all miss their deadline together.
+AdmissionController lets a fixed number of requests run, queues a few
+more for a short time, and answers the rest at once with 503 and
+Retry-After, so the requests it does accept still finish quickly.
+"""
+import threading
+from collections import deque
+
+# Request classes, in the order waiting requests are let in
+CHEAP = 'cheap'
+EXPENSIVE = 'expensive'
+
+DEFAULT_MAX_CONCURRENT = 32
+DEFAULT_QUEUE_TIMEOUT = 0.5     # seconds
+
+
+class Waiter:
+    """A request waiting for a slot."""
+
+    __slots__ = ('kind', 'event', 'admitted')
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.event = threading.Event()
+        self.admitted = False
+
+
+class AdmissionController:
+    """
+    WSGI middleware that limits how many requests run at once.
+
+    classify(environ) sorts each request into CHEAP or EXPENSIVE, or
+    returns None for requests that are never limited (such as event
+    streams, which stay open but are idle).  Expensive requests may only
+    fill expensive_share of the slots, so cheap ones always find room.
+    Cheap requests also jump ahead of expensive ones in the queue.
+
+    A request that finds no free slot waits at most queue_timeout seconds.
+    When max_queue requests are already waiting, it is rejected at once.
+    A slot is held until the response body has been sent or closed.
+    """
+
+    def __init__(self, app, classify, max_concurrent=DEFAULT_MAX_CONCURRENT, expensive_share=0.5,
+                 queue_timeout=DEFAULT_QUEUE_TIMEOUT, max_queue=None, retry_after=1):
+        self.app = app
+        self.classify = classify
+        self.max_concurrent = max_concurrent
+        self.expensive_limit = max(1, int(max_concurrent * expensive_share))
+        self.queue_timeout = queue_timeout
+        self.max_queue = max_concurrent if max_queue is None else max_queue
+        self.retry_after = retry_after
+        self.active = 0
+        self.rejected = 0
+        self._active_expensive = 0
+        self._waiting = {CHEAP: deque(), EXPENSIVE: deque()}
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        kind = self.classify(environ)
+        if kind is None:
+            return self.app(environ, start_response)
+        if not self.admit(kind):
+            return self.reject(start_response)
+        try:
+            body = self.app(environ, start_response)
+        except BaseException:
+            self.release(kind)
+            raise
+        return ReleasedWhenDone(body, self, kind)
+
+    @property
+    def queued(self):
+        """Requests waiting for a slot."""
+        return len(self._waiting[CHEAP]) + len(self._waiting[EXPENSIVE])
+
+    def admit(self, kind):
+        """Waits for a slot for a request, returning False if it should be rejected."""
+        with self._lock:
+            # Nobody may overtake a request of the same or a cheaper class
+            waiting_ahead = self._waiting[CHEAP] or (kind == EXPENSIVE and self._waiting[EXPENSIVE])
+            if not waiting_ahead and self._can_start(kind):
+                self._start(kind)
+                return True
+            if self.queued >= self.max_queue:
+                self.rejected += 1
+                return False
+            waiter = Waiter(kind)
+            self._waiting[kind].append(waiter)
+
+        waiter.event.wait(self.queue_timeout)
+        with self._lock:
+            if waiter.admitted:     # a slot may have been handed over just in time
+                return True
+            self._waiting[kind].remove(waiter)
+            self.rejected += 1
+            return False
+
+    def release(self, kind):
+        """Frees a request's slot and hands it to the next waiting request."""
+        with self._lock:
+            self.active -= 1
+            if kind == EXPENSIVE:
+                self._active_expensive -= 1
+            for waiting_kind in (CHEAP, EXPENSIVE):
+                waiting = self._waiting[waiting_kind]
+                while waiting and self._can_start(waiting_kind):
+                    waiter = waiting.popleft()
+                    self._start(waiting_kind)
+                    waiter.admitted = True
+                    waiter.event.set()
+
+    def reject(self, start_response):
+        body = b'{"message":"The server is too busy, please retry later"}\n'
+        start_response('503 SERVICE UNAVAILABLE', [
+            ('Content-Type', 'application/json'),
+            ('Content-Length', str(len(body))),
+            ('Retry-After', str(self.retry_after)),
+        ])
+        return [body]
+
+    def _can_start(self, kind):
+        if self.active >= self.max_concurrent:
+            return False
+        return kind == CHEAP or self._active_expensive < self.expensive_limit
+
+    def _start(self, kind):
+        self.active += 1
+        if kind == EXPENSIVE:
+            self._active_expensive += 1
+
+
+class ReleasedWhenDone:
+    """
+    Passes a response body through and frees its slot as soon as the body
+    has been sent in full or closed, whichever comes first.
+    """
+
+    __slots__ = ('body', 'controller', 'kind')
+
+    def __init__(self, body, controller, kind):
+        self.body = body
+        self.controller = controller
+        self.kind = kind
+
+    def __iter__(self):
+        yield from self.body
+        self._release()
+
+    def close(self):
+        try:
+            if hasattr(self.body, 'close'):
+                self.body.close()
+        finally:
+            self._release()
+
+    def __del__(self):
+        # A server that drops the body without closing it must not keep the slot
+        self._release()
+
+    def _release(self):
+        if self.kind is not None:
+            kind, self.kind = self.kind, None
+            self.controller.release(kind)
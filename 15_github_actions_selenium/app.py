@@ -1,29 +1,308 @@
 # app.py
-from flask import Flask, jsonify, request, render_template, make_response
+from flask import Blueprint, Flask, Response, current_app, jsonify, request, render_template, make_response
+from werkzeug.local import LocalProxy
 import json
+import base64
+import hashlib
+from os import getenv
+from urllib.parse import parse_qs
+from admission import CHEAP, EXPENSIVE, AdmissionController
+from compression import ResponseCompressor
+from metrics import MetricsMiddleware
+from pet import DataValidationError
+from petevents import ChangeBroadcaster, change_message, resync_message, sse_message
+from petstore import SEARCH_FIELDS, create_store, search_filters
 
-# A simple in-memory dictionary to simulate a database for our pets
-pets = {}
-next_id = 1
+# Number of pets serialized per chunk of a streamed listing
+STREAM_CHUNK_SIZE = 500
 
-app = Flask(__name__)
+# Seconds between keep-alive comments on an idle event stream
+KEEPALIVE_SECONDS = 15
 
-# Helper function to generate a unique ID
-def get_next_id():
-    """Generates a unique ID for a new pet."""
-    global next_id
-    current_id = next_id
-    next_id += 1
-    return current_id
+# Pages of up to this many pets count as cheap reads for admission control
+CHEAP_PAGE_SIZE = 1000
+
+
+def default_config():
+    """
+    Reads the pet shop's settings from the environment:
+      PETSTORE_BACKEND            memory (the default) or sqlite
+      PETSTORE_PATH               the SQLite database file (default pets.db)
+      PETSTORE_LOG_DIR            a directory where the memory store logs its changes
+      PETSTORE_COMPRESS_MIN_SIZE  smallest body compressed, in bytes (default 1024)
+      PETSTORE_MAX_CONCURRENT     requests that may run at once (default 32)
+      PETSTORE_QUEUE_TIMEOUT_MS   how long the rest wait for a turn (default 500)
+      PETSTORE_LOG_LEVEL          the lowest level the app logs (default INFO)
+    Every worker process has its own memory store, so servers that run several
+    worker processes should use the sqlite backend, which they all share.
+    """
+    return {
+        'PETSTORE_BACKEND': getenv('PETSTORE_BACKEND', 'memory'),
+        'PETSTORE_PATH': getenv('PETSTORE_PATH', 'pets.db'),
+        'PETSTORE_LOG_DIR': getenv('PETSTORE_LOG_DIR'),
+        'PETSTORE_COMPRESS_MIN_SIZE': int(getenv('PETSTORE_COMPRESS_MIN_SIZE', '1024')),
+        'PETSTORE_MAX_CONCURRENT': int(getenv('PETSTORE_MAX_CONCURRENT', '32')),
+        'PETSTORE_QUEUE_TIMEOUT_MS': int(getenv('PETSTORE_QUEUE_TIMEOUT_MS', '500')),
+        'PETSTORE_LOG_LEVEL': getenv('PETSTORE_LOG_LEVEL', 'INFO'),
+    }
+
+
+class PetShop:
+    """The state one pet shop app works on: its store, broadcaster and compressor."""
+
+    def __init__(self, config):
+        backend = config['PETSTORE_BACKEND']
+        if backend == 'sqlite':
+            self.store = create_store(backend, path=config['PETSTORE_PATH'])
+        else:
+            self.store = create_store(backend, log_dir=config['PETSTORE_LOG_DIR'])
+        # Pushes the store's changes to the clients of /pets/stream
+        self.broadcaster = ChangeBroadcaster(self.store)
+        # Responses of at least PETSTORE_COMPRESS_MIN_SIZE bytes are gzip or
+        # deflate compressed for clients that accept it
+        self.compressor = ResponseCompressor(min_size=config['PETSTORE_COMPRESS_MIN_SIZE'])
+
+
+def create_app(config=None):
+    """
+    Builds a pet shop app with its own store.  config overrides the
+    settings default_config() reads from the environment.
+
+    Nothing is built when this module is imported: the store (and the
+    modules of its backend) and the middleware are created here, and the
+    templates are only loaded by the first request that renders one.
+    """
+    app = Flask(__name__)
+    app.config.update(default_config())
+    app.config.update(config or {})
+    app.logger.setLevel(app.config['PETSTORE_LOG_LEVEL'])
+    shop = app.extensions['petshop'] = PetShop(app.config)
+    app.register_blueprint(api)
+    app.after_request(shop.compressor)
+
+    # At most PETSTORE_MAX_CONCURRENT requests run at once.  The rest wait up
+    # to PETSTORE_QUEUE_TIMEOUT_MS for a turn, cheap ones first, and are then
+    # turned away with 503 and Retry-After
+    admission = AdmissionController(
+        app.wsgi_app, classify_request,
+        max_concurrent=app.config['PETSTORE_MAX_CONCURRENT'],
+        queue_timeout=app.config['PETSTORE_QUEUE_TIMEOUT_MS'] / 1000)
+
+    # Per-route latency histograms, requests in flight and store size at /metrics
+    gauges = {
+        'petshop_pets': lambda: len(shop.store),
+        'petshop_stream_subscribers': lambda: len(shop.broadcaster),
+        'petshop_admission_active': lambda: admission.active,
+        'petshop_admission_queued': lambda: admission.queued,
+    }
+    if hasattr(shop.store, 'recovery_seconds'):
+        gauges['petshop_recovery_seconds'] = lambda: shop.store.recovery_seconds
+        app.logger.info(f"Recovered {len(shop.store)} pets in {shop.store.recovery_seconds:.3f} s")
+    app.wsgi_app = MetricsMiddleware(admission, gauges=gauges)
+    return app
+
+def __getattr__(name):
+    """Builds the default app the first time app.app is used (flask run, gunicorn app:app)."""
+    if name == 'app':
+        globals()['app'] = create_app()
+        return globals()['app']
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# The routes are registered on every app create_app() builds, and reach
+# that app's store and broadcaster through these proxies
+api = Blueprint('petshop', __name__)
+store = LocalProxy(lambda: current_app.extensions['petshop'].store)
+broadcaster = LocalProxy(lambda: current_app.extensions['petshop'].broadcaster)
+
+# Helper function for admission control
+def classify_request(environ):
+    """
+    Sorts a request for the admission controller: unpaged or streamed
+    listings, batches and bulk changes are expensive, event streams are
+    not limited, and everything else is cheap.
+    """
+    path = environ.get('PATH_INFO')
+    if path == '/pets/stream':
+        return None
+    if path == '/pets/batch' or (path == '/pets' and environ.get('REQUEST_METHOD') in ('PATCH', 'DELETE')):
+        return EXPENSIVE
+    if path == '/pets' and environ.get('REQUEST_METHOD') == 'GET':
+        query = parse_qs(environ.get('QUERY_STRING', ''))
+        limit = query.get('limit', [''])[0]
+        if not limit.isdigit() or int(limit) > CHEAP_PAGE_SIZE or 'stream' in query:
+            return EXPENSIVE
+    return CHEAP
+
+# Helper functions for conditional GET requests
+def listing_etag(version, req):
+    """
+    Builds the ETag of a listing from the store version and the query.
+    The Accept-Encoding header is part of it because a compressed body is
+    a different representation that needs its own ETag.  Compressed bodies
+    are cached for every client by ETag, so the query is hashed with
+    BLAKE2 rather than a checksum that a crafted query could collide with.
+    """
+    query = b'\0'.join([req.path.encode(), req.query_string, req.headers.get('Accept', '').encode(),
+                        req.headers.get('Accept-Encoding', '').encode()])
+    return f"{version}-{hashlib.blake2b(query, digest_size=16).hexdigest()}"
+
+# Helper functions for cursor-based pagination
+def encode_cursor(pet_id):
+    """Turns the last pet ID of a page into an opaque cursor."""
+    return base64.urlsafe_b64encode(str(pet_id).encode()).decode()
+
+def decode_cursor(cursor):
+    """Turns an opaque cursor back into the pet ID it points after."""
+    try:
+        return int(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except (ValueError, UnicodeError):
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+def get_page_args(args):
+    """Reads the limit and cursor parameters, returning (limit, after_id)."""
+    limit = args.get('limit')
+    if limit is not None:
+        if not limit.isdigit() or int(limit) < 1:
+            raise ValueError(f"Invalid limit: {limit}")
+        limit = int(limit)
+    cursor = args.get('cursor')
+    after_id = decode_cursor(cursor) if cursor else 0
+    return limit, after_id
+
+# Helper function for streamed listings
+def stream_pets(ids, view, ndjson=False):
+    """
+    Yields the pets with the given IDs, read from a ReadView, as a JSON
+    array, or as one JSON document per line when ndjson is set,
+    STREAM_CHUNK_SIZE pets at a time.  The caller closes the view once the
+    response is closed.
+    """
+    separator = b'' if ndjson else b'['
+    for start in range(0, len(ids), STREAM_CHUNK_SIZE):
+        chunk = []
+        for pet_id in ids[start:start + STREAM_CHUNK_SIZE]:
+            pet_json = view.get_json(pet_id)
+            if pet_json is not None:    # not in this version of the store
+                chunk.append(pet_json)
+        if not chunk:
+            continue
+        if ndjson:
+            yield b'\n'.join(chunk) + b'\n'
+        else:
+            yield separator + b','.join(chunk)
+            separator = b','
+    if not ndjson:
+        yield b'[]' if separator == b'[' else b']'
+
+def json_listing(ids, source):
+    """Joins the cached JSON of the pets with the given IDs, read from a store or a view, into one array."""
+    return b'[' + b','.join(pet_json for pet_json in map(source.get_json, ids) if pet_json is not None) + b']'
+
+# Helper function for the event stream
+def stream_changes(shop, subscription, last_event_id=None):
+    """
+    Yields the Server-Sent Events of a subscription until the client goes
+    away or is evicted for falling behind.  A reconnecting client that sends
+    Last-Event-ID first gets the changes it missed from the change feed.
+    It runs after the request has ended, so it is given the app's PetShop.
+    """
+    store, broadcaster = shop.store, shop.broadcaster
+    try:
+        version = subscription.version
+        if last_event_id is not None:
+            version, events = store.changes(last_event_id)
+            if events is None:
+                yield resync_message(version)
+            else:
+                yield ''.join(change_message(event) for event in events)
+        yield sse_message('ready', {'version': version}, version)
+        while not subscription.evicted:
+            item = subscription.get(KEEPALIVE_SECONDS)
+            if item is None:
+                yield ': keep-alive\n\n'     # also notices clients that have gone
+            elif item[0] > version:
+                yield item[1]
+        # Changes were dropped, so the client has to reload before reconnecting
+        yield resync_message(broadcaster.version)
+    finally:
+        broadcaster.unsubscribe(subscription)
+
+# Helper function for batch creation
+def read_batch(req):
+    """Reads the pets of a batch request from a JSON array or NDJSON body."""
+    if req.mimetype == 'application/x-ndjson':
+        try:
+            new_pets = [json.loads(line) for line in req.get_data(as_text=True).splitlines() if line.strip()]
+        except ValueError:
+            raise ValueError("Invalid NDJSON body")
+    else:
+        new_pets = req.get_json(silent=True)
+        if not isinstance(new_pets, list):
+            raise ValueError("Expected a JSON array of pets")
+    if not all(isinstance(pet, dict) for pet in new_pets):
+        raise ValueError("Every pet must be a JSON object")
+    return new_pets
+
+# Helper functions for bulk updates and deletes
+def read_bulk_updates(req, store):
+    """
+    Reads the body of a bulk update, returning its (pet ID, changes) pairs.
+    The body is either a JSON array of objects that each hold a pet's ID
+    and the fields to change, or {"filter": {...}, "patch": {...}} to
+    apply one patch to every pet the search filters match.
+    """
+    body = req.get_json(silent=True)
+    if isinstance(body, dict):
+        filters, patch = body.get('filter'), body.get('patch')
+        if not isinstance(filters, dict) or not isinstance(patch, dict):
+            raise ValueError("Expected a filter object and a patch object")
+        # Empty filters are dropped, like in a search, and must not leave a filter that matches every pet
+        filters = search_filters(filters)
+        if not filters:
+            raise ValueError("Give the pets to update as search filters with a value")
+        return [(pet_id, patch) for pet_id in store.find(filters)[0]]
+    if not isinstance(body, list):
+        raise ValueError("Expected a JSON array of pets or a filter and a patch")
+    if not all(isinstance(item, dict) and type(item.get('id')) is int for item in body):
+        raise ValueError("Every pet must be a JSON object with an integer id")
+    return [(item['id'], item) for item in body]
+
+def read_bulk_deletes(args, store):
+    """Returns the IDs a bulk delete names in ?ids=1,2,3 or matches by search filters."""
+    ids = args.get('ids')
+    if ids:
+        try:
+            return [int(pet_id) for pet_id in ids.split(',')]
+        except ValueError:
+            raise ValueError(f"Invalid ids: {ids}")
+    filters = {field: args.get(field) for field in SEARCH_FIELDS if args.get(field)}
+    if not filters:
+        raise ValueError("Give the pets to delete in ids or as search filters")
+    return store.find(filters)[0]
+
+def bulk_result(pet_id, pet, status):
+    """Builds the result of one pet in a bulk update or delete."""
+    if not pet:
+        return {"id": pet_id, "status": 404, "message": f"Pet with ID {pet_id} not found"}
+    if pet is True:
+        return {"id": pet_id, "status": status}
+    return {"id": pet_id, "status": status, "pet": pet.to_dict()}
+
+# Wakes the broadcaster as soon as a request may have changed the pets
+@api.after_app_request
+def notify_broadcaster(response):
+    if request.method != 'GET':
+        broadcaster.notify()
+    return response
 
 # Route for the homepage
-@app.route('/')
+@api.route('/')
 def home():
     """Serves the homepage for the app."""
     return render_template('index.html')
 
-# API endpoint to get all pets or search by category
-@app.route('/pets', methods=['GET', 'POST'])
+# API endpoint to get all pets or search by category and name
+@api.route('/pets', methods=['GET', 'POST'])
 def handle_pets():
     """
     Handles pet creation (POST) and searching (GET).
@@ -32,60 +311,192 @@ def handle_pets():
     For a GET request, it returns pets that match the search criteria.
     """
     if request.method == 'POST':
-        new_pet = request.get_json()
-        new_id = get_next_id()
-        new_pet['id'] = new_id
-        pets[new_id] = new_pet
-        response_data = jsonify(new_pet)
+        try:
+            new_pet = store.create(request.get_json())
+        except DataValidationError as error:
+            return jsonify({"message": str(error)}), 400
+        response_data = jsonify(new_pet.to_dict())
         response_data.status_code = 201
         return response_data
 
     if request.method == 'GET':
-        category = request.args.get('category')
-        if category:
-            matching_pets = [pet for pet in pets.values() if pet['category'] == category]
-            return jsonify(matching_pets)
-        
-        return jsonify(list(pets.values()))
+        # Nothing has changed since the client's copy, so skip the work entirely
+        etag = listing_etag(store.version, request)
+        if request.if_none_match.contains(etag):
+            response = make_response('', 304)
+            response.set_etag(etag)
+            return response
+
+        try:
+            limit, after_id = get_page_args(request.args)
+        except ValueError as error:
+            return jsonify({"message": str(error)}), 400
+
+        # The search and every pet in the body use one view of the store,
+        # without blocking writers.  A pet written meanwhile is left out of
+        # the page as its version is later than X-Pets-Version, and
+        # /pets/changes still delivers it
+        view = store.read_view()
+        version = view.version
+        etag = listing_etag(version, request)
+
+        # Each search parameter has an index; the store plans which to start from
+        filters = {field: request.args.get(field) for field in SEARCH_FIELDS}
+        plan = {} if request.args.get('explain') == 'true' else None
+        try:
+            page, has_more = store.find(filters, after_id, limit, plan, view)
+        except ValueError as error:
+            view.close()
+            return jsonify({"message": str(error)}), 400
+
+        # Streamed listings are serialized chunk by chunk instead of all at once.
+        # The view is closed with the response, even one closed before its
+        # first chunk, which never runs the generator at all
+        ndjson = request.accept_mimetypes.best_match(
+            ['application/json', 'application/x-ndjson']) == 'application/x-ndjson'
+        if ndjson or request.args.get('stream') == 'true':
+            response = Response(stream_pets(page, view, ndjson),
+                                mimetype='application/x-ndjson' if ndjson else 'application/json')
+            response.call_on_close(view.close)
+        else:
+            with view:
+                response = Response(json_listing(page, view), mimetype='application/json')
+        if has_more:
+            response.headers['X-Next-Cursor'] = encode_cursor(page[-1])
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Pets-Version'] = str(version)
+        if plan is not None:
+            response.headers['X-Query-Plan'] = json.dumps(plan, separators=(',', ':'))
+        return response
+
+# API endpoint for the changes made since a version
+@api.route('/pets/changes', methods=['GET'])
+def pet_changes():
+    """
+    Returns the pets created, updated and deleted after the version in ?since=.
+
+    When those changes are no longer all known (the client is too far
+    behind, or the pets were reset), resync is true and the client should
+    fetch the pets again.
+    """
+    since = request.args.get('since', '')
+    if not since.isdigit():
+        return jsonify({"message": f"Invalid version: {since}"}), 400
+
+    version, events = store.changes(int(since))
+    if events is None:
+        return jsonify({"version": version, "resync": True, "changes": []})
+    return jsonify({"version": version, "resync": False, "changes": events})
+
+# API endpoint for the dashboard's counts
+@api.route('/pets/stats', methods=['GET'])
+def pet_stats():
+    """
+    Returns the number of pets in total and per category, gender and
+    availability, kept up to date by every write instead of counted here.
+    """
+    version = store.version
+    response = jsonify(store.stats())
+    response.headers['X-Pets-Version'] = str(version)
+    return response
+
+# API endpoint that pushes changes as they happen
+@api.route('/pets/stream', methods=['GET'])
+def pet_stream():
+    """
+    Streams every create, update and delete as a Server-Sent Event.
+
+    Each event's id is the store version, so EventSource resumes where it
+    left off after a reconnect.  A resync event means changes were missed
+    and the client should fetch the pets again.
+    """
+    last_event_id = request.headers.get('Last-Event-ID', '')
+    subscription = broadcaster.subscribe()
+    shop = current_app.extensions['petshop']
+    response = Response(stream_changes(shop, subscription, int(last_event_id) if last_event_id.isdigit() else None),
+                        mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+# API endpoint to create many pets in one request
+@api.route('/pets/batch', methods=['POST'])
+def create_pets():
+    """
+    Creates every pet in a JSON array (or an NDJSON body) and returns their IDs.
+
+    The IDs are reserved as one block and the store version is bumped once.
+    """
+    try:
+        new_ids = store.create_many(read_batch(request))
+    except (ValueError, DataValidationError) as error:
+        return jsonify({"message": str(error)}), 400
+    response_data = jsonify({"ids": new_ids})
+    response_data.status_code = 201
+    return response_data
+
+# API endpoints for changing many pets in one request
+@api.route('/pets', methods=['PATCH'])
+def update_pets():
+    """
+    Updates every pet listed in the body, or every pet a filter matches.
+
+    All pets are changed as one store operation, with one pass over the
+    indexes and one version bump, and the result of each pet is returned.
+    """
+    try:
+        changes = read_bulk_updates(request, store)
+        pets = store.update_many(changes)
+    except (ValueError, DataValidationError) as error:
+        return jsonify({"message": str(error)}), 400
+    return jsonify({"results": [bulk_result(pet_id, pet, 200) for (pet_id, _), pet in zip(changes, pets)]})
+
+@api.route('/pets', methods=['DELETE'])
+def delete_pets():
+    """Deletes the pets in ?ids= or every pet the search filters match, as one change."""
+    try:
+        pet_ids = read_bulk_deletes(request.args, store)
+    except ValueError as error:
+        return jsonify({"message": str(error)}), 400
+    deleted = store.delete_many(pet_ids)
+    return jsonify({"results": [bulk_result(pet_id, found, 204) for pet_id, found in zip(pet_ids, deleted)]})
 
 # API endpoint for updating a pet
-@app.route('/pets/<int:pet_id>', methods=['PUT'])
+@api.route('/pets/<int:pet_id>', methods=['PUT'])
 def update_pet(pet_id):
     """
     Updates an existing pet.
     """
-    if pet_id not in pets:
+    try:
+        pet = store.update(pet_id, request.get_json())
+    except DataValidationError as error:
+        return jsonify({"message": str(error)}), 400
+    if pet is None:
       return jsonify({"message": f"Pet with ID {pet_id} not found"}), 404
     
-    data = request.get_json()
-    pet = pets[pet_id]
-    pet.update(data)
-    pets[pet_id] = pet
-    return jsonify(pet), 200
+    return jsonify(pet.to_dict()), 200
 
 # API endpoint for deleting a pet
-@app.route('/pets/<int:pet_id>', methods=['DELETE'])
+@api.route('/pets/<int:pet_id>', methods=['DELETE'])
 def delete_pet(pet_id):
     """
-    Deletes a single pet from the dictionary by ID.
+    Deletes a single pet from the store by ID.
     """
-    if pet_id not in pets:
+    if not store.delete(pet_id):
         return jsonify({"message": f"Pet with ID {pet_id} not found"}), 404
         
-    del pets[pet_id]
     return make_response('', 204)
 
 # Added a route to clear the pets list for testing purposes
-@app.route('/pets/reset', methods=['POST'])
+@api.route('/pets/reset', methods=['POST'])
 def reset_pets():
     """Clears the pets list and resets the ID counter."""
-    global pets, next_id
-    pets = {}
-    next_id = 1
+    store.reset()
     response = make_response('', 204)
     return response
     
-@app.route('/shutdown')
+@api.route('/shutdown')
 def shutdown(): # pragma: no cover
     """Shuts down the server gracefully for testing purposes."""
     func = request.environ.get('werkzeug.server.shutdown')
@@ -94,4 +505,8 @@ def shutdown(): # pragma: no cover
     return 'Server shutting down...'
 
 if __name__ == '__main__': # pragma: no cover
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    from werkzeug.serving import is_running_from_reloader
+    # The reloader's watching process only restarts this script, so only the
+    # process it starts to serve the requests builds the app and its store
+    main = create_app() if is_running_from_reloader() else Flask(__name__)
+    main.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,382 @@
+# asgi_app.py
+"""
+The pet shop API as an ASGI application.
+
+It serves the same routes as app.py with the same helpers, over a PetShop
+built from the same settings, but each request is a coroutine on one event loop instead of a
+thread, so thousands of slow clients and open event streams cost little
+more than their sockets.  Run it with any ASGI server, for example:
+
+    uvicorn asgi_app:app --port 5000
+
+Requests are parsed into Werkzeug Request objects and answered with
+Werkzeug Responses, so the handlers read like their Flask counterparts.
+The in-memory store is called directly, because it never blocks for long;
+other stores, and every write to a store that waits for its log to reach
+disk, run in a worker thread so the event loop never waits on I/O.
+"""
+import asyncio
+import io
+import json
+import os
+import time
+from jinja2 import Environment, FileSystemLoader
+from werkzeug.exceptions import HTTPException
+from werkzeug.routing import Map, Rule
+from werkzeug.wrappers import Request, Response
+import app as wsgi_app
+from app import (PetShop, bulk_result, default_config, encode_cursor, get_page_args, json_listing,
+                 listing_etag, read_batch, read_bulk_deletes, read_bulk_updates, stream_pets)
+from metrics import MetricsMiddleware, server_timing
+from pet import DataValidationError
+from petevents import change_message, resync_message, sse_message
+from petstore import SEARCH_FIELDS, PetStore
+
+# The store, broadcaster and compressor, configured from the environment like app.py's
+shop = PetShop(default_config())
+store, broadcaster, compressor = shop.store, shop.broadcaster, shop.compressor
+
+# Records the latencies; handle() serves them at /metrics
+metrics = MetricsMiddleware(None, gauges={
+    'petshop_pets': lambda: len(store),
+    'petshop_stream_subscribers': lambda: len(broadcaster),
+})
+
+# Whether store reads and writes may block the event loop
+BLOCKING_READS = not isinstance(store, PetStore)
+BLOCKING_WRITES = type(store) is not PetStore
+
+# Maps each URL rule to its handler coroutine
+url_map = Map()
+
+# The homepage has nothing dynamic in it, so it is rendered once
+templates = Environment(loader=FileSystemLoader(os.path.join(os.path.dirname(__file__), 'templates')),
+                        autoescape=True)
+home_page = None
+
+
+def route(rule, methods):
+    """Registers a coroutine as the handler of a URL rule, like Flask's app.route."""
+    def register(handler):
+        url_map.add(Rule(rule, endpoint=handler, methods=methods))
+        return handler
+    return register
+
+async def read(method, *args):
+    """Calls a store method that only reads."""
+    if BLOCKING_READS:
+        return await asyncio.to_thread(method, *args)
+    return method(*args)
+
+async def write(method, *args):
+    """Calls a store method that changes the pets."""
+    if BLOCKING_WRITES:
+        return await asyncio.to_thread(method, *args)
+    return method(*args)
+
+def json_response(data, status=200):
+    return Response(json.dumps(data, separators=(',', ':')) + '\n', status, mimetype='application/json')
+
+async def iterate(chunks):
+    """Yields the chunks of a body, reading blocking stores in a worker thread."""
+    chunks = iter(chunks)
+    while True:
+        if BLOCKING_READS:
+            reading = asyncio.ensure_future(asyncio.to_thread(next, chunks, None))
+            try:
+                chunk = await asyncio.shield(reading)
+            except asyncio.CancelledError:
+                # The body is closed next, which must wait until the thread is done with it
+                await asyncio.wait([reading])
+                raise
+        else:
+            chunk = next(chunks, None)
+        if chunk is None:
+            return
+        yield chunk
+
+
+######################################################################
+# Routes, mirroring the ones in app.py
+######################################################################
+
+@route('/', methods=['GET'])
+async def home(request):
+    """Serves the homepage for the app."""
+    global home_page
+    if home_page is None:
+        home_page = templates.get_template('index.html').render()
+    return Response(home_page, mimetype='text/html')
+
+@route('/pets', methods=['GET', 'POST'])
+async def handle_pets(request):
+    """Handles pet creation (POST) and searching (GET)."""
+    if request.method == 'POST':
+        try:
+            new_pet = await write(store.create, request.get_json())
+        except DataValidationError as error:
+            return json_response({"message": str(error)}, 400)
+        return json_response(new_pet.to_dict(), 201)
+
+    etag = listing_etag(await read(lambda: store.version), request)
+    if request.if_none_match.contains(etag):
+        response = Response('', 304)
+        response.set_etag(etag)
+        return response
+
+    try:
+        limit, after_id = get_page_args(request.args)
+    except ValueError as error:
+        return json_response({"message": str(error)}, 400)
+
+    # The search and the bodies use one view, like in app.py
+    view = await read(store.read_view)
+    version = view.version
+    etag = listing_etag(version, request)
+    filters = {field: request.args.get(field) for field in SEARCH_FIELDS}
+    plan = {} if request.args.get('explain') == 'true' else None
+    try:
+        page, has_more = await read(store.find, filters, after_id, limit, plan, view)
+    except ValueError as error:
+        await read(view.close)
+        return json_response({"message": str(error)}, 400)
+
+    ndjson = request.accept_mimetypes.best_match(
+        ['application/json', 'application/x-ndjson']) == 'application/x-ndjson'
+    if ndjson or request.args.get('stream') == 'true':
+        response = Response(stream_pets(page, view, ndjson),
+                            mimetype='application/x-ndjson' if ndjson else 'application/json')
+        response.call_on_close(view.close)
+    else:
+        try:
+            response = Response(await read(json_listing, page, view), mimetype='application/json')
+        finally:
+            await read(view.close)
+    if has_more:
+        response.headers['X-Next-Cursor'] = encode_cursor(page[-1])
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Pets-Version'] = str(version)
+    if plan is not None:
+        response.headers['X-Query-Plan'] = json.dumps(plan, separators=(',', ':'))
+    return response
+
+@route('/pets/changes', methods=['GET'])
+async def pet_changes(request):
+    """Returns the pets created, updated and deleted after the version in ?since=."""
+    since = request.args.get('since', '')
+    if not since.isdigit():
+        return json_response({"message": f"Invalid version: {since}"}, 400)
+
+    version, events = await read(store.changes, int(since))
+    if events is None:
+        return json_response({"version": version, "resync": True, "changes": []})
+    return json_response({"version": version, "resync": False, "changes": events})
+
+@route('/pets/stats', methods=['GET'])
+async def pet_stats(request):
+    """Returns the number of pets in total and per category, gender and availability."""
+    version = await read(lambda: store.version)
+    response = json_response(await read(store.stats))
+    response.headers['X-Pets-Version'] = str(version)
+    return response
+
+@route('/pets/stream', methods=['GET'])
+async def pet_stream(request):
+    """Streams every create, update and delete as a Server-Sent Event."""
+    last_event_id = request.headers.get('Last-Event-ID', '')
+    subscription = broadcaster.subscribe(asyncio.get_running_loop())
+    response = Response(stream_changes(subscription, int(last_event_id) if last_event_id.isdigit() else None),
+                        mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+async def stream_changes(subscription, last_event_id=None):
+    """Yields the Server-Sent Events of a subscription, like app.stream_changes."""
+    try:
+        version = subscription.version
+        if last_event_id is not None:
+            version, events = await read(store.changes, last_event_id)
+            if events is None:
+                yield resync_message(version)
+            else:
+                yield ''.join(change_message(event) for event in events)
+        yield sse_message('ready', {'version': version}, version)
+        while not subscription.evicted:
+            item = await subscription.get(wsgi_app.KEEPALIVE_SECONDS)
+            if item is None:
+                yield ': keep-alive\n\n'
+            elif item[0] > version:
+                yield item[1]
+        yield resync_message(broadcaster.version)
+    finally:
+        broadcaster.unsubscribe(subscription)
+
+@route('/pets/batch', methods=['POST'])
+async def create_pets(request):
+    """Creates every pet in a JSON array (or an NDJSON body) and returns their IDs."""
+    try:
+        new_ids = await write(store.create_many, read_batch(request))
+    except (ValueError, DataValidationError) as error:
+        return json_response({"message": str(error)}, 400)
+    return json_response({"ids": new_ids}, 201)
+
+@route('/pets', methods=['PATCH'])
+async def update_pets(request):
+    """Updates every pet listed in the body, or every pet a filter matches, as one change."""
+    try:
+        changes = await read(read_bulk_updates, request, store)
+        pets = await write(store.update_many, changes)
+    except (ValueError, DataValidationError) as error:
+        return json_response({"message": str(error)}, 400)
+    return json_response({"results": [bulk_result(pet_id, pet, 200) for (pet_id, _), pet in zip(changes, pets)]})
+
+@route('/pets', methods=['DELETE'])
+async def delete_pets(request):
+    """Deletes the pets in ?ids= or every pet the search filters match, as one change."""
+    try:
+        pet_ids = await read(read_bulk_deletes, request.args, store)
+    except ValueError as error:
+        return json_response({"message": str(error)}, 400)
+    deleted = await write(store.delete_many, pet_ids)
+    return json_response({"results": [bulk_result(pet_id, found, 204) for pet_id, found in zip(pet_ids, deleted)]})
+
+@route('/pets/<int:pet_id>', methods=['PUT'])
+async def update_pet(request, pet_id):
+    """Updates an existing pet."""
+    try:
+        pet = await write(store.update, pet_id, request.get_json())
+    except DataValidationError as error:
+        return json_response({"message": str(error)}, 400)
+    if pet is None:
+        return json_response({"message": f"Pet with ID {pet_id} not found"}, 404)
+    return json_response(pet.to_dict())
+
+@route('/pets/<int:pet_id>', methods=['DELETE'])
+async def delete_pet(request, pet_id):
+    """Deletes a single pet from the store by ID."""
+    if not await write(store.delete, pet_id):
+        return json_response({"message": f"Pet with ID {pet_id} not found"}, 404)
+    return Response('', 204)
+
+@route('/pets/reset', methods=['POST'])
+async def reset_pets(request):
+    """Clears the pets list and resets the ID counter."""
+    await write(store.reset)
+    return Response('', 204)
+
+
+######################################################################
+# The ASGI application
+######################################################################
+
+def wsgi_environ(scope, body):
+    """Builds the WSGI environ of a request, so Werkzeug can parse it."""
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'].encode().decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'CONTENT_LENGTH': str(len(body)),
+    }
+    for name, value in scope['headers']:
+        key = name.decode('latin-1').upper().replace('-', '_')
+        if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            key = 'HTTP_' + key
+        value = value.decode('latin-1')
+        environ[key] = f"{environ[key]},{value}" if key in environ and key.startswith('HTTP_') else value
+    return environ
+
+async def read_body(receive):
+    body = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        body.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(body)
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+async def handle(request):
+    """Finds and runs the handler of a request, then applies the after-request steps."""
+    if request.path == metrics.path:
+        return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+    started = time.perf_counter_ns()
+    route = 'unmatched'
+    try:
+        rule, values = url_map.bind_to_environ(request.environ).match(return_rule=True)
+        route = rule.rule
+        response = await rule.endpoint(request, **values)
+    except HTTPException as error:
+        response = error.get_response(request.environ)
+    if request.method != 'GET':
+        broadcaster.notify()
+    response = compressor.compress_response(response, request.accept_encodings)
+
+    elapsed = time.perf_counter_ns() - started
+    response.headers['Server-Timing'] = server_timing(elapsed)
+    metrics.record(route, request.method, str(response.status_code), elapsed)
+    return response
+
+async def send_body(response, send):
+    body = response.response
+    chunks = body if hasattr(body, '__aiter__') else iterate(response.iter_encoded())
+    async for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+
+async def app(scope, receive, send):
+    """The ASGI entry point."""
+    if scope['type'] == 'lifespan':
+        while (await receive())['type'] != 'lifespan.shutdown':
+            await send({'type': 'lifespan.startup.complete'})
+        await send({'type': 'lifespan.shutdown.complete'})
+        return
+
+    metrics.request_started()
+    try:
+        await serve(scope, receive, send)
+    finally:
+        metrics.request_finished()
+
+async def serve(scope, receive, send):
+    body = await read_body(receive)
+    if body is None:
+        return
+    request = Request(wsgi_environ(scope, body))
+    response = await handle(request)
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                        for name, value in response.headers.items()],
+        })
+        if request.method != 'HEAD':
+            # Stop sending as soon as the client goes away, even while waiting for an event
+            sending = asyncio.ensure_future(send_body(response, send))
+            disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+            await asyncio.wait([sending, disconnected], return_when=asyncio.FIRST_COMPLETED)
+            disconnected.cancel()
+            if not sending.done():
+                sending.cancel()
+                await asyncio.wait([sending])
+                return
+            sending.result()
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+    finally:
+        # Runs the response's close callbacks, such as closing a streamed listing's view
+        response.close()
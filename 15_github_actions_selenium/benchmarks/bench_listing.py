@@ -0,0 +1,61 @@
+"""
+Compares how fast GET /pets builds its body with and without the JSON
+each pet keeps from when it was stored.
+
+Usage (from the 15_github_actions_selenium directory):
+    python benchmarks/bench_listing.py [number_of_pets]
+"""
+import os
+import sys
+import random
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from flask import jsonify  # noqa: E402
+from app import create_app, json_listing  # noqa: E402
+
+CATEGORIES = ['dog', 'cat', 'fish', 'bird', 'lion', 'rabbit']
+GENDERS = ['MALE', 'FEMALE']
+
+app = create_app()
+store = app.extensions['petshop'].store
+
+
+def fill_store(count):
+    """Creates count pets in the app's store."""
+    random.seed(42)
+    store.reset()
+    store.create_many([{
+        "name": f"Pet {pet_id}",
+        "category": random.choice(CATEGORIES),
+        "gender": random.choice(GENDERS),
+        "available": random.random() < 0.5,
+        "birthday": f"20{random.randrange(10, 24)}-0{random.randrange(1, 10)}-1{random.randrange(10)}",
+    } for pet_id in range(1, count + 1)])
+
+
+def encode_every_time(ids):
+    """The listing as it was built before: every pet encoded on every request."""
+    return jsonify([pet.to_dict() for pet in map(store.get, ids) if pet is not None]).get_data()
+
+
+def listings_per_second(build, ids):
+    runs, seconds = timeit.Timer(lambda: build(ids)).autorange()
+    return runs / seconds
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    fill_store(count)
+    print(f"{count:,} pets")
+    with app.test_request_context('/pets'):
+        for limit in (10, 100, 1000, count):
+            ids, _ = store.find(limit=limit)
+            uncached = listings_per_second(encode_every_time, ids)
+            cached = listings_per_second(lambda ids: json_listing(ids, store), ids)
+            print(f"  {limit:>9,} per page: {uncached:10,.1f} listings/s without cache, "
+                  f"{cached:10,.1f} with cache ({cached / uncached:5.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Measures what MetricsMiddleware adds to each request.
+
+It times a WSGI application that does nothing, called directly and through
+the middleware, the way a WSGI server calls it (start_response, iterate
+the body, close it).  The difference is the middleware's own cost, with
+no network or Flask time mixed in.
+
+Usage (from the 15_github_actions_selenium directory):
+    python benchmarks/bench_metrics_overhead.py [number_of_requests]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from metrics import MetricsMiddleware  # noqa: E402
+
+# The most the middleware may add to a request, in microseconds
+BUDGET_MICROS = 5.0
+
+ENVIRON = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/pets'}
+
+
+def empty_app(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'application/json')])
+    return [b'[]']
+
+
+def start_response(status, headers, exc_info=None):
+    pass
+
+
+def serve(app, count):
+    """Returns the mean microseconds per request of count requests."""
+    started = time.perf_counter()
+    for _ in range(count):
+        body = app(dict(ENVIRON), start_response)
+        for _ in body:
+            pass
+        if hasattr(body, 'close'):
+            body.close()
+    return (time.perf_counter() - started) / count * 1e6
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    wrapped = MetricsMiddleware(empty_app, gauges={'pets': lambda: 0})
+    serve(wrapped, 1000)    # warm up
+    bare = min(serve(empty_app, count) for _ in range(3))
+    measured = min(serve(wrapped, count) for _ in range(3))
+    overhead = measured - bare
+    print(f"{count:,} requests")
+    print(f"  without middleware: {bare:6.2f} us per request")
+    print(f"  with middleware:    {measured:6.2f} us per request")
+    print(f"  overhead:           {overhead:6.2f} us per request (budget {BUDGET_MICROS} us)")
+    started = time.perf_counter()
+    wrapped.render()
+    print(f"  rendering /metrics: {(time.perf_counter() - started) * 1e3:6.2f} ms")
+    sys.exit(0 if overhead <= BUDGET_MICROS else 1)
+
+
+if __name__ == '__main__':
+    main()
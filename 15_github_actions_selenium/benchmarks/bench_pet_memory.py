@@ -0,0 +1,62 @@
+"""
+Compares the memory used by pets stored as plain dicts and as Pet records.
+
+Usage (from the 15_github_actions_selenium directory):
+    python benchmarks/bench_pet_memory.py [number_of_pets]
+"""
+import os
+import sys
+import gc
+import json
+import random
+import tracemalloc
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from pet import Pet  # noqa: E402
+
+CATEGORIES = ['dog', 'cat', 'fish', 'bird', 'lion', 'rabbit']
+GENDERS = ['MALE', 'FEMALE']
+
+
+def request_bodies(count):
+    """Returns the JSON request bodies that create count pets."""
+    random.seed(42)
+    first_birthday = date(2010, 1, 1)
+    return [json.dumps({
+        "name": f"Pet {pet_id}",
+        "category": random.choice(CATEGORIES),
+        "gender": random.choice(GENDERS),
+        "available": random.random() < 0.5,
+        "birthday": (first_birthday + timedelta(days=random.randrange(5000))).isoformat(),
+    }) for pet_id in range(1, count + 1)]
+
+
+def measure(make_pet, bodies):
+    """Returns the bytes per pet kept alive when each decoded body goes through make_pet."""
+    gc.collect()
+    tracemalloc.start()
+    pets = {}
+    for pet_id, body in enumerate(bodies, start=1):
+        data = json.loads(body)     # fresh strings, like a real request
+        data['id'] = pet_id
+        pets[pet_id] = make_pet(data)
+    used, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del pets
+    return used / len(bodies)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    bodies = request_bodies(count)
+    as_dicts = measure(lambda data: data, bodies)
+    as_pets = measure(Pet.from_dict, bodies)
+    print(f"{count:,} pets")
+    print(f"  dict per pet:  {as_dicts:8.1f} bytes  ({as_dicts * count / 2**20:8.1f} MiB)")
+    print(f"  Pet per pet:   {as_pets:8.1f} bytes  ({as_pets * count / 2**20:8.1f} MiB)")
+    print(f"  saved:         {1 - as_pets / as_dicts:8.1%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""
+Measures how long a fresh pet shop process takes to serve its first request.
+
+Every run starts a new Python interpreter, so nothing is imported or
+cached yet, and times three steps in it: importing app, building the app
+with create_app(), and answering the first GET / and GET /pets.  The
+median and best of all runs are printed for each step, so the numbers
+can be compared from one release to the next.
+
+Usage (from the 15_github_actions_selenium directory):
+    python benchmarks/bench_startup.py [number_of_runs]
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Runs in each new interpreter and prints the time of every step, in seconds
+CHILD = """
+import json, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+application = app.create_app()
+created = time.perf_counter()
+client = application.test_client()
+assert client.get('/').status_code == 200
+assert client.get('/pets').status_code == 200
+served = time.perf_counter()
+print(json.dumps([imported - started, created - imported, served - created, served - started]))
+"""
+
+STEPS = ['import app', 'create_app()', 'first requests', 'total']
+
+
+def run_once():
+    """Returns the seconds each step took in a new interpreter."""
+    env = dict(os.environ, PETSTORE_BACKEND='memory')
+    env.pop('PETSTORE_LOG_DIR', None)
+    output = subprocess.run([sys.executable, '-c', CHILD], cwd=APP_DIR, env=env,
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    run_once()  # writes the bytecode caches, which a deployed app already has
+    runs = [run_once() for _ in range(count)]
+    print(f"{count} cold starts")
+    for step, times in zip(STEPS, zip(*runs)):
+        print(f"  {step:<15} median {statistics.median(times) * 1e3:7.1f} ms, "
+              f"best {min(times) * 1e3:7.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+# compression.py
+"""
+Negotiated gzip and deflate compression for the pet shop's responses.
+
+Pet listings repeat the same keys and the same few categories over and
+over, so they shrink to a fraction of their size.  Small bodies are sent
+as they are, because compressing them costs more than it saves.
+"""
+import threading
+import zlib
+from collections import OrderedDict
+from flask import request
+
+# The encodings we offer, with the zlib wbits that produce each one
+ENCODINGS = {'gzip': 16 + zlib.MAX_WBITS, 'deflate': zlib.MAX_WBITS}
+
+# Media types worth compressing.  Event streams are left alone, because
+# each event has to reach the client the moment it is sent.
+COMPRESSIBLE_TYPES = {'application/json', 'application/x-ndjson', 'text/html'}
+
+# Bodies smaller than this many bytes are not compressed
+DEFAULT_MIN_SIZE = 1024
+
+# Number of compressed bodies kept for responses that have an ETag
+DEFAULT_CACHE_SIZE = 64
+
+
+class ResponseCompressor:
+    """
+    An after_request hook that compresses responses the client accepts
+    compressed.  Servers without Flask's request context call
+    compress_response() directly.
+
+    A streamed body is compressed chunk by chunk, and each chunk is flushed
+    so the client can decode it right away.  A response with an ETag names
+    one version of its body, so its compressed body is kept in a small LRU
+    cache and reused while the ETag stays the same.
+    """
+
+    def __init__(self, min_size=DEFAULT_MIN_SIZE, level=6, cache_size=DEFAULT_CACHE_SIZE):
+        self.min_size = min_size
+        self.level = level
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    def __call__(self, response):
+        return self.compress_response(response, request.accept_encodings)
+
+    def compress_response(self, response, accept_encodings):
+        """Compresses response in the best of our encodings that the client accepts."""
+        if (response.status_code != 200 or response.direct_passthrough
+                or response.mimetype not in COMPRESSIBLE_TYPES
+                or 'Content-Encoding' in response.headers):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = accept_encodings.best_match(list(ENCODINGS))
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            response.response = self.compress_chunks(response.response, encoding)
+            response.headers.pop('Content-Length', None)
+        else:
+            body = response.get_data()
+            if len(body) < self.min_size:
+                return response
+            etag, _ = response.get_etag()
+            response.set_data(self.compress_cached(etag, body, encoding) if etag
+                              else self.compress(body, encoding))
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+    def compress(self, body, encoding):
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, ENCODINGS[encoding])
+        return compressor.compress(body) + compressor.flush()
+
+    def compress_chunks(self, chunks, encoding):
+        """Yields a compressed chunk as soon as each chunk of the body is ready."""
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, ENCODINGS[encoding])
+        try:
+            for chunk in chunks:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode()
+                data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+                if data:
+                    yield data
+            yield compressor.flush()
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+
+    def compress_cached(self, etag, body, encoding):
+        """Compresses body, or reuses the result for the same ETag and encoding."""
+        key = (etag, encoding)
+        with self._cache_lock:
+            compressed = self._cache.get(key)
+            if compressed is not None:
+                self._cache.move_to_end(key)
+                return compressed
+        compressed = self.compress(body, encoding)
+        with self._cache_lock:
+            self._cache[key] = compressed
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return compressed
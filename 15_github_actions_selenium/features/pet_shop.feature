@@ -21,6 +21,13 @@ Feature: Pet CRUD & Search
     And I delete pet ID "1"
     Then the pet list should not show "Buddy"
 
+  Scenario: Search by name
+    When I create a pet with name "Buddy", category "dog", gender "MALE", birthday "2024-01-01"
+    And I create a pet with name "Fido", category "dog", gender "MALE", birthday "2025-06-01"
+    When I search for the name "Fido"
+    Then the pet list should show "Fido"
+    And the pet list should not show "Buddy"
+
   Scenario: Search by category is case-insensitive
     When I create a pet with name "Buddy", category "dog", gender "MALE", birthday "2024-01-01"
     And I create a pet with name "Neko", category "cat", gender "FEMALE", birthday "2025-03-15"
@@ -76,3 +76,9 @@ def step_impl(context, pet_category):
     context.driver.find_element(By.ID, "pet_category").send_keys(pet_category)
     context.driver.find_element(By.ID, "search-btn").click()
     time.sleep(0.5)
+
+@when('I search for the name "{pet_name}"')
+def step_impl(context, pet_name):
+    context.driver.find_element(By.ID, "pet_name").send_keys(pet_name)
+    context.driver.find_element(By.ID, "search-btn").click()
+    time.sleep(0.5)
@@ -0,0 +1,68 @@
+from locust import HttpUser, task, between
+import uuid
+
+# Checks that the pet shop stays consistent when it runs as several worker
+# processes sharing one store (PETSTORE_BACKEND=sqlite).  Every user writes
+# a pet and reads it back right away, and each request may be answered by
+# a different worker, so a worker with its own private copy of the pets
+# shows up as failures.
+
+
+class PetShopConsistencyUser(HttpUser):
+    host = "http://127.0.0.1:5000"
+    wait_time = between(0, 0)
+
+    # IDs handed out so far, shared by all users of this locust process
+    seen_ids = set()
+
+    def find_by_name(self, name):
+        """Returns the pets with exactly this name, or None if the request failed."""
+        with self.client.get("/pets", params={"name": name}, name="/pets?name=",
+                             catch_response=True) as response:
+            if response.status_code != 200:
+                response.failure(f"Got non-200 status code: {response.status_code}")
+                return None
+            response.success()
+            return response.json()
+
+    @task
+    def create_read_update_delete(self):
+        name = f"Fluffy-{uuid.uuid4().hex}"
+
+        # 1. Every created pet must get an ID no other pet ever had
+        with self.client.post("/pets", json={"name": name, "category": "dog"},
+                              catch_response=True) as response:
+            if response.status_code != 201:
+                response.failure(f"Got non-201 status code: {response.status_code}")
+                return
+            pet_id = response.json()["id"]
+            if pet_id in self.seen_ids:
+                response.failure(f"Pet ID {pet_id} was handed out twice")
+                return
+            self.seen_ids.add(pet_id)
+            response.success()
+
+        # 2. The new pet must be visible to whichever worker answers next
+        pets = self.find_by_name(name)
+        if pets is not None and [pet["id"] for pet in pets] != [pet_id]:
+            self.fail_check("read after create", f"expected pet {pet_id}, got {pets}")
+            return
+
+        # 3. So must its update
+        self.client.put(f"/pets/{pet_id}", json={"available": False}, name="/pets/[id]")
+        pets = self.find_by_name(name)
+        if pets is not None and (len(pets) != 1 or pets[0].get("available") is not False):
+            self.fail_check("read after update", f"expected pet {pet_id} to be unavailable, got {pets}")
+            return
+
+        # 4. And its deletion
+        self.client.delete(f"/pets/{pet_id}", name="/pets/[id]")
+        pets = self.find_by_name(name)
+        if pets:
+            self.fail_check("read after delete", f"pet {pet_id} is still listed")
+
+    def fail_check(self, name, message):
+        """Reports a failed consistency check in the locust statistics."""
+        self.environment.events.request.fire(
+            request_type="CHECK", name=name, response_time=0, response_length=0,
+            exception=AssertionError(message), context={})
@@ -0,0 +1,107 @@
+"""
+Pet class
+"""
+import sys
+import json
+from datetime import date
+
+# The fields every pet has, besides its ID
+FIELDS = ('name', 'category', 'gender', 'available', 'birthday')
+
+
+class DataValidationError(Exception):
+    """Used for data validation errors when deserializing"""
+
+
+class Pet:
+    """
+    Class that represents a Pet
+
+    Pets use __slots__ instead of a per-instance dict, categories and
+    genders are interned so every pet shares the same few strings, and the
+    birthday is packed into its proleptic Gregorian ordinal.  Keys outside
+    the schema are kept in extra, which stays None for almost every pet.
+    Pets are treated as immutable once stored: updated() returns a new one.
+    That is what makes it safe for to_json() to keep the encoded pet.
+    """
+
+    __slots__ = ('id', 'name', 'category', 'gender', 'available', 'birthday_ordinal', 'extra', '_json')
+
+    def __init__(self, id=None, name=None, category=None, gender=None,
+                 available=None, birthday=None, extra=None):
+        self.id = id
+        self.name = name
+        self.category = sys.intern(category) if category is not None else None
+        self.gender = sys.intern(gender) if gender is not None else None
+        self.available = available
+        self.birthday_ordinal = date.fromisoformat(birthday).toordinal() if birthday else None
+        self.extra = extra or None
+        self._json = None
+
+    def __repr__(self):
+        return '<Pet %r id=[%s]>' % (self.name, self.id)
+
+    def __eq__(self, other):
+        return isinstance(other, Pet) and self.to_dict() == other.to_dict()
+
+    @property
+    def birthday(self):
+        """The birthday as an ISO date string, or None"""
+        if self.birthday_ordinal is None:
+            return None
+        return date.fromordinal(self.birthday_ordinal).isoformat()
+
+    def to_dict(self) -> dict:
+        """Serializes the class as a dictionary, leaving out unset fields"""
+        data = {'id': self.id}
+        if self.name is not None:
+            data['name'] = self.name
+        if self.category is not None:
+            data['category'] = self.category
+        if self.gender is not None:
+            data['gender'] = self.gender
+        if self.available is not None:
+            data['available'] = self.available
+        if self.birthday_ordinal is not None:
+            data['birthday'] = self.birthday
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    def to_json(self) -> bytes:
+        """Returns the pet encoded as JSON, encoding it only the first time"""
+        if self._json is None:
+            self._json = json.dumps(self.to_dict(), separators=(',', ':')).encode()
+        return self._json
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        """Deserializes a Pet from a dictionary, validating every field"""
+        if not isinstance(data, dict):
+            raise DataValidationError("Invalid pet: body of request contained bad or no data")
+        pet_id = data.get('id')
+        return cls(id=pet_id if isinstance(pet_id, int) else None).updated(data)
+
+    def updated(self, data: dict):
+        """Returns a new Pet with the fields in data changed (the ID never changes)"""
+        if not isinstance(data, dict):
+            raise DataValidationError("Invalid pet: body of request contained bad or no data")
+        fields = {field: getattr(self, field) for field in FIELDS}
+        extra = dict(self.extra) if self.extra else {}
+        for key, value in data.items():
+            if key == 'id':
+                continue
+            if key not in fields:
+                extra[key] = value
+            elif key == 'available':
+                if value is not None and not isinstance(value, bool):
+                    raise DataValidationError(f"Invalid type for boolean [available]: {type(value).__name__}")
+                fields[key] = value
+            elif value is not None and not isinstance(value, str):
+                raise DataValidationError(f"Invalid type for string [{key}]: {type(value).__name__}")
+            else:
+                fields[key] = value
+        try:
+            return Pet(id=self.id, extra=extra, **fields)
+        except ValueError:
+            raise DataValidationError(f"Invalid date for [birthday]: {fields['birthday']}")
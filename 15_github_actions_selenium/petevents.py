@@ -0,0 +1,202 @@
+# petevents.py
+"""
+Pushes pet changes to subscribers as Server-Sent Events.
+
+One ChangeBroadcaster per process follows the store's change feed and
+hands every change to all subscribers.  Each change is formatted as an
+SSE message once, no matter how many clients receive it.  Each
+subscriber has a small queue of its own.  A client too slow to keep its
+queue from filling up is evicted instead of making the others wait or
+letting its backlog grow.
+"""
+import json
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Versions of the store a subscriber may fall behind by before it is
+# evicted.  All the changes of one version are queued as one message.
+SUBSCRIBER_QUEUE_SIZE = 256
+
+# Seconds between checks of the change feed when no local write wakes us.
+# Other worker processes sharing a SQLite store only show up this way.
+POLL_INTERVAL = 0.5
+
+
+def sse_message(event, data, event_id=None):
+    """Formats one Server-Sent Events message."""
+    lines = [f"id: {event_id}"] if event_id is not None else []
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, separators=(',', ':'))}")
+    return '\n'.join(lines) + '\n\n'
+
+def change_message(change):
+    """Formats a change event from the store's change feed."""
+    return sse_message(change['type'], change, change['version'])
+
+def resync_message(version):
+    """Tells a subscriber it missed changes and has to reload the pets."""
+    return sse_message('resync', {'version': version}, version)
+
+
+def version_messages(events):
+    """
+    Returns one (version, messages) pair per version of the store, so a
+    batch that changed many pets at once takes one place in a queue.
+    """
+    messages = []
+    for event in events:
+        if messages and messages[-1][0] == event['version']:
+            messages[-1][1].append(change_message(event))
+        else:
+            messages.append((event['version'], [change_message(event)]))
+    return [(version, ''.join(parts)) for version, parts in messages]
+
+
+class Subscription:
+    """One subscriber's queue of (version, message) pairs."""
+
+    def __init__(self, version, queue_size):
+        self.version = version      # changes up to this one were sent before subscribing
+        self.queue = queue.Queue(queue_size)
+        self.evicted = False
+
+    def offer(self, messages):
+        """Queues messages, returning False if they do not all fit."""
+        try:
+            for message in messages:
+                self.queue.put_nowait(message)
+        except queue.Full:
+            return False
+        return True
+
+    def get(self, timeout):
+        """Returns the next (version, message), or None after timeout seconds."""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class AsyncSubscription(Subscription):
+    """
+    A subscription read by a coroutine instead of a thread.
+
+    The broadcaster thread hands messages to the subscriber's event loop,
+    which only accepts them from its own thread, so the queue size is
+    counted here.
+    """
+
+    def __init__(self, version, queue_size, loop):
+        # Only the ASGI app subscribes this way, so the WSGI app never imports asyncio
+        import asyncio
+        self.version = version
+        self.queue = asyncio.Queue()
+        self.queue_size = queue_size
+        self.evicted = False
+        self._loop = loop
+        self._queued = 0
+        self._queued_lock = threading.Lock()
+
+    def offer(self, messages):
+        with self._queued_lock:
+            if self._queued + len(messages) > self.queue_size:
+                return False
+            self._queued += len(messages)
+        try:
+            for message in messages:
+                self._loop.call_soon_threadsafe(self.queue.put_nowait, message)
+        except RuntimeError:    # the loop is closed, so nobody is listening
+            return False
+        return True
+
+    async def get(self, timeout):
+        """Returns the next (version, message), or None after timeout seconds."""
+        import asyncio
+        try:
+            message = await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        with self._queued_lock:
+            self._queued -= 1
+        return message
+
+
+class ChangeBroadcaster:
+    """
+    Follows store.changes() on a background thread and fans the events out.
+
+    The thread starts with the first subscriber, so a server that forks its
+    workers runs one per worker.  notify() wakes it right away after a
+    local write; changes made elsewhere are picked up every poll_interval.
+    """
+
+    def __init__(self, store, queue_size=SUBSCRIBER_QUEUE_SIZE, poll_interval=POLL_INTERVAL):
+        self.store = store
+        self.queue_size = queue_size
+        self.poll_interval = poll_interval
+        self.version = None
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def __len__(self):
+        return len(self._subscribers)
+
+    def subscribe(self, loop=None):
+        """
+        Returns a new Subscription to every change after the current version,
+        or an AsyncSubscription for a coroutine running on loop.
+        """
+        with self._lock:
+            if self._thread is None:
+                self.version = self.store.version
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            if loop is None:
+                subscription = Subscription(self.version, self.queue_size)
+            else:
+                subscription = AsyncSubscription(self.version, self.queue_size, loop)
+            self._subscribers.add(subscription)
+            return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def notify(self):
+        """Tells the broadcaster that the store has just changed."""
+        self._wakeup.set()
+
+    def poll(self):
+        """Publishes the changes made since the last poll."""
+        version, events = self.store.changes(self.version)
+        if version == self.version:
+            return
+        if events is None:
+            self.publish([(version, resync_message(version))])
+        else:
+            self.publish(version_messages(events))
+        self.version = version
+
+    def publish(self, messages):
+        """Queues messages for every subscriber, evicting those that are full."""
+        with self._lock:
+            for subscription in list(self._subscribers):
+                if not subscription.offer(messages):
+                    subscription.evicted = True
+                    self._subscribers.discard(subscription)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+            # A failed read (such as a locked SQLite database) must not stop
+            # the thread; the next poll asks again from the same version
+            try:
+                self.poll()
+            except Exception:
+                logger.exception("Could not read the change feed")
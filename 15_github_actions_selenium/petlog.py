@@ -0,0 +1,258 @@
+# petlog.py
+"""
+Optional persistence for the in-memory pet store.
+
+LoggedPetStore appends every change to a write-ahead log and does not let
+the request that made it return until the log is on disk.  A background
+thread regularly writes a snapshot of all pets and starts a new log
+segment, so a restart only loads the snapshot and replays the log tail.
+"""
+import fcntl
+import json
+import os
+import threading
+import time
+from contextlib import ExitStack
+from pet import FIELDS, Pet
+from petstore import PetStore
+
+SNAPSHOT_FILE = 'snapshot.json'
+LOCK_FILE = 'lock'
+SEGMENT_PREFIX = 'log.'
+
+# Seconds between background snapshots
+DEFAULT_SNAPSHOT_INTERVAL = 300
+
+
+class LoggedPetStore(PetStore):
+    """
+    An in-memory PetStore that survives restarts.
+
+    Each change is one compact JSON line: ["c", pets], ["u", pets],
+    ["d", pet_ids] or ["r"].  Writers only append to the log file's buffer
+    while they hold their locks; a flusher thread fsyncs whatever has
+    piled up since its last fsync (group commit), and each writer waits
+    outside its locks until its own record is durable.
+
+    Only one store may use a directory at a time: a second one, in this
+    process or another, raises RuntimeError instead of writing snapshots
+    and deleting segments under the first one.
+    """
+
+    def __init__(self, directory, snapshot_interval=DEFAULT_SNAPSHOT_INTERVAL, **options):
+        super().__init__(**options)
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock_file = open(os.path.join(directory, LOCK_FILE), 'a')
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._lock_file.close()
+            raise RuntimeError(f"{directory} is already used by another pet store") from None
+        self._log_lock = threading.Lock()
+        self._log_changed = threading.Condition(self._log_lock)
+        self._fsync_lock = threading.Lock()
+        self._written = 0       # number of the last record written to the log
+        self._durable = 0       # number of the last record known to be on disk
+        self._local = threading.local()
+        self._closing = threading.Event()
+
+        started = time.perf_counter()
+        self._replaying = True
+        self._segment = self._recover()
+        self._replaying = False
+        self.recovery_seconds = time.perf_counter() - started
+        self._log = open(self._segment_path(self._segment), 'a', encoding='utf-8')
+
+        self._threads = [threading.Thread(target=self._flush_loop, daemon=True)]
+        if snapshot_interval:
+            self._threads.append(threading.Thread(
+                target=self._snapshot_loop, args=(snapshot_interval,), daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def create(self, data):
+        return self._when_durable(super().create(data))
+
+    def create_many(self, items):
+        return self._when_durable(super().create_many(items))
+
+    def update(self, pet_id, data):
+        return self._when_durable(super().update(pet_id, data))
+
+    def update_many(self, changes):
+        return self._when_durable(super().update_many(changes))
+
+    def delete(self, pet_id):
+        return self._when_durable(super().delete(pet_id))
+
+    def delete_many(self, pet_ids):
+        return self._when_durable(super().delete_many(pet_ids))
+
+    def reset(self):
+        return self._when_durable(super().reset())
+
+    def snapshot(self):
+        """Writes a snapshot of every pet and starts a new log segment."""
+        # Every change happens under a stripe lock, so holding all of them
+        # gives a point where the pets match the end of the current segment
+        with ExitStack() as stack:
+            for _, lock in self._stripes:
+                stack.enter_context(lock)
+            pets = [record.pet for stripe, _ in self._stripes for record in stripe.values()
+                    if record.pet is not None]
+            state = {'version': self._version, 'next_id': self._next_id}
+            with self._fsync_lock, self._log_lock:
+                self._log.flush()
+                os.fsync(self._log.fileno())
+                self._log.close()
+                self._durable = self._written
+                self._log_changed.notify_all()
+                self._segment += 1
+                self._log = open(self._segment_path(self._segment), 'a', encoding='utf-8')
+                state['segment'] = self._segment
+
+        # Pets are never changed in place, so they can be written without locks
+        pets.sort(key=lambda pet: pet.id)
+        path = os.path.join(self.directory, SNAPSHOT_FILE)
+        with open(path + '.tmp', 'w', encoding='utf-8') as file:
+            json.dump({**state, 'pets': [pet.to_dict() for pet in pets]}, file, separators=(',', ':'))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(path + '.tmp', path)
+        for number in self._segments():
+            if number < state['segment']:
+                os.remove(self._segment_path(number))
+
+    def close(self):
+        """Stops the background threads and syncs the log."""
+        if self._closing.is_set():
+            return
+        self._closing.set()
+        with self._log_lock:
+            self._log_changed.notify_all()
+        for thread in self._threads:
+            thread.join()
+        with self._log_lock:
+            self._log.flush()
+            os.fsync(self._log.fileno())
+            self._log.close()
+            self._durable = self._written
+            self._log_changed.notify_all()
+        self._lock_file.close()
+
+    ######################################################################
+    # Internal helpers
+    ######################################################################
+
+    def _changed(self, kind, data):
+        super()._changed(kind, data)
+        if self._replaying:
+            return
+        if kind == 'create':
+            record = ['c', [pet.to_dict() for pet in data]]
+        elif kind == 'update':
+            record = ['u', [pet.to_dict() for pet in data]]
+        elif kind == 'delete':
+            record = ['d', [pet.id for pet in data]]
+        else:
+            record = ['r']
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        with self._log_lock:
+            if self._closing.is_set():
+                raise RuntimeError("The pet store is closed")
+            self._log.write(line)
+            self._written += 1
+            self._local.record = self._written
+            self._log_changed.notify_all()
+
+    def _when_durable(self, result):
+        """Waits until this thread's last record is on disk, then returns result."""
+        record = getattr(self._local, 'record', 0)
+        with self._log_lock:
+            while self._durable < record:
+                self._log_changed.wait()
+        return result
+
+    def _flush_loop(self):
+        """Fsyncs the log whenever records are waiting, one group at a time."""
+        while True:
+            with self._log_lock:
+                while self._durable == self._written and not self._closing.is_set():
+                    self._log_changed.wait()
+                if self._closing.is_set():
+                    return
+            with self._fsync_lock:
+                with self._log_lock:
+                    if self._durable == self._written:  # a snapshot synced them
+                        continue
+                    self._log.flush()
+                    written = self._written
+                    fileno = self._log.fileno()
+                os.fsync(fileno)    # writers keep appending the next group meanwhile
+            with self._log_lock:
+                self._durable = max(self._durable, written)
+                self._log_changed.notify_all()
+
+    def _snapshot_loop(self, interval):
+        while not self._closing.wait(interval):
+            self.snapshot()
+
+    def _segment_path(self, number):
+        return os.path.join(self.directory, f"{SEGMENT_PREFIX}{number:06d}")
+
+    def _segments(self):
+        """Returns the numbers of the log segments on disk, in order."""
+        return sorted(int(name[len(SEGMENT_PREFIX):]) for name in os.listdir(self.directory)
+                      if name.startswith(SEGMENT_PREFIX) and name[len(SEGMENT_PREFIX):].isdigit())
+
+    def _recover(self):
+        """Loads the snapshot, replays the log after it and returns the segment to append to."""
+        segment = 1
+        path = os.path.join(self.directory, SNAPSHOT_FILE)
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as file:
+                snapshot = json.load(file)
+            self._store([Pet.from_dict(data) for data in snapshot['pets']])
+            self._version = snapshot['version']
+            self._next_id = snapshot['next_id']
+            self._forget_changes()
+            segment = snapshot['segment']
+        for number in self._segments():
+            if number >= segment:
+                self._replay(self._segment_path(number))
+                segment = number
+        return segment
+
+    def _replay(self, path):
+        """Applies the records of one log segment, dropping a torn last record."""
+        good_bytes = 0
+        with open(path, 'rb') as file:
+            for line in file:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                self._apply(record)
+                good_bytes += len(line)
+        if good_bytes < os.path.getsize(path):
+            with open(path, 'r+b') as file:
+                file.truncate(good_bytes)
+
+    def _apply(self, record):
+        """Repeats a logged change without logging it again."""
+        if record[0] == 'c':
+            self._store([Pet.from_dict(data) for data in record[1]])
+            if record[1]:
+                self._next_id = max(self._next_id, record[1][-1]['id'] + 1)
+        elif record[0] == 'u':
+            # Each record is the whole pet, so fields it leaves out were unset.
+            # Logs written before bulk updates hold a single pet or ID.
+            pets = record[1] if isinstance(record[1], list) else [record[1]]
+            self._update_many([(data['id'], {**dict.fromkeys(FIELDS), **data}) for data in pets])
+        elif record[0] == 'd':
+            self._delete_many(record[1] if isinstance(record[1], list) else [record[1]])
+        else:
+            PetStore.reset(self)
@@ -0,0 +1,888 @@
+# petstore.py
+"""
+Storage backends for the pet shop.
+
+PetStore keeps the pets in memory.  Pets are sharded into stripes by ID,
+each with its own lock, and every secondary index has a lock of its own,
+so threads that work on different pets do not wait for each other.
+Readers never lock the pets at all: each pet is a chain of versions, and
+a ReadView sees every pet as it was at one version of the store.
+SqlitePetStore (in sqlite_store.py) has the same methods and keeps the
+pets in a SQLite database; create_store() picks one by name.
+"""
+import bisect
+import threading
+from collections import deque
+from contextlib import ExitStack
+from datetime import date
+from pet import Pet
+
+# Length of the longest n-gram in the substring index
+NGRAM_SIZE = 3
+
+# Number of lock stripes the pets are sharded into
+DEFAULT_STRIPES = 16
+
+# Number of recent change events kept for GET /pets/changes
+CHANGE_LOG_SIZE = 10000
+
+# The filters find() accepts, as they appear in the query string
+SEARCH_FIELDS = ('category', 'name', 'name_prefix', 'name_contains',
+                 'gender', 'available', 'birthday_from', 'birthday_to')
+
+# The birthday index keeps ordinal << BIRTHDAY_SHIFT | pet ID as one int,
+# which sorts by birthday and then ID and is smaller than a tuple
+BIRTHDAY_SHIFT = 40
+ID_MASK = (1 << BIRTHDAY_SHIFT) - 1
+
+
+# Helper functions for the secondary indexes
+def index_key(value):
+    """Normalizes a value so that lookups are case-insensitive."""
+    return str(value).casefold()
+
+def filter_key(field, value):
+    """
+    Turns the value of a search filter into the key its index uses: a
+    case-folded string, True or False for available, or a date ordinal for
+    the birthday bounds.  Raises ValueError for unknown fields and values.
+    """
+    if field == 'available':
+        if isinstance(value, bool):
+            return value
+        if str(value).lower() not in ('true', 'false'):
+            raise ValueError(f"Invalid value for available: {value}")
+        return str(value).lower() == 'true'
+    if field in ('birthday_from', 'birthday_to'):
+        try:
+            return date.fromisoformat(value).toordinal()
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid date for {field}: {value}")
+    if field not in SEARCH_FIELDS:
+        raise ValueError(f"Unknown search field: {field}")
+    return index_key(value)
+
+def search_filters(filters):
+    """
+    Returns the search filters that have a value, dropping the empty ones.
+    Raises ValueError for a field not in SEARCH_FIELDS, empty or not.
+    """
+    for field in filters:
+        if field not in SEARCH_FIELDS:
+            raise ValueError(f"Unknown search field: {field}")
+    return {field: value for field, value in filters.items() if value not in (None, '')}
+
+def matches_filters(pet, filters):
+    """Tells whether a pet matches every filter, given as keys from filter_key()."""
+    for field, key in filters.items():
+        if field == 'available':
+            matched = pet.available == key
+        elif field in ('birthday_from', 'birthday_to'):
+            ordinal = pet.birthday_ordinal
+            matched = ordinal is not None and (ordinal >= key if field == 'birthday_from' else ordinal <= key)
+        else:
+            value = getattr(pet, 'name' if field.startswith('name') else field)
+            value = index_key(value) if value is not None else None
+            if value is None:
+                matched = False
+            elif field == 'name_prefix':
+                matched = value.startswith(key)
+            elif field == 'name_contains':
+                matched = key in value
+            else:
+                matched = value == key
+        if not matched:
+            return False
+    return True
+
+def ngrams(text):
+    """Returns every substring of text that is at most NGRAM_SIZE long."""
+    return {text[i:i + n] for n in range(1, NGRAM_SIZE + 1) for i in range(len(text) - n + 1)}
+
+def add_to_index(index, key, pet_id):
+    """Adds a pet ID under key, returning True if key is new to the index."""
+    ids = index.get(key)
+    if ids is None:
+        index[key] = [pet_id]
+        return True
+    if ids[-1] < pet_id:    # new pets have the highest IDs so far
+        ids.append(pet_id)
+    else:
+        bisect.insort(ids, pet_id)
+    return False
+
+def remove_from_index(index, key, pet_id):
+    """Removes a pet ID from under key, returning True if key is now gone."""
+    ids = index.get(key)
+    if ids is None:
+        return False
+    position = bisect.bisect_left(ids, pet_id)
+    if position < len(ids) and ids[position] == pet_id:
+        del ids[position]
+    if ids:
+        return False
+    del index[key]
+    return True
+
+def contains(ids, pet_id):
+    """Tells whether a sorted list of IDs holds pet_id."""
+    position = bisect.bisect_left(ids, pet_id)
+    return position < len(ids) and ids[position] == pet_id
+
+def ids_after(ids, after_id, count=None):
+    """Returns up to count IDs after after_id from a sorted list of IDs."""
+    start = bisect.bisect_right(ids, after_id)
+    return ids[start:] if count is None else ids[start:start + count]
+
+
+class Condition:
+    """
+    One step of a query plan: the pets a filter matches according to its
+    index.  rows is how many there are, scan(after_id, count) lists up to
+    count of their IDs after after_id in ascending order, and probe(ids)
+    keeps the IDs of a smaller candidate list that match.
+    """
+
+    __slots__ = ('name', 'rows', 'scan', 'probe')
+
+    def __init__(self, name, rows, scan, probe):
+        self.name = name
+        self.rows = rows
+        self.scan = scan
+        self.probe = probe
+
+
+class Record:
+    """
+    One version of a pet: the Pet stored at version, or None once it was
+    deleted, followed by the versions before it that a reader may still see.
+    """
+
+    __slots__ = ('version', 'pet', 'older')
+
+    def __init__(self, version, pet, older=None):
+        self.version = version
+        self.pet = pet
+        self.older = older
+
+
+def prune(record, oldest):
+    """Drops the versions of a pet that no reader at oldest or later can see."""
+    visible = record
+    while visible is not None and visible.version > oldest:
+        visible = visible.older
+    if visible is not None:
+        visible.older = None
+    return record
+
+
+class ReadView:
+    """
+    The pets as they were at one version of a PetStore.
+
+    Reads walk the version chains without any lock, so a long listing never
+    holds up writers, and every pet it returns belongs to the same version.
+    Close the view (or use it in a with block) once done with it, so the
+    store can reclaim the versions only it could see.
+    """
+
+    __slots__ = ('store', 'version', '_open')
+
+    def __init__(self, store, version):
+        self.store = store
+        self.version = version
+        self._open = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __del__(self):
+        # A view dropped without being closed must not pin old versions
+        # forever.  This may run while its thread holds store locks, so the
+        # store is only told through a queue it empties later.
+        if self._open:
+            self._open = False
+            self.store._abandoned_views.append(self.version)
+
+    def get(self, pet_id):
+        """Returns the pet with the given ID as of this view's version, or None."""
+        record = self.store._stripe(pet_id)[0].get(pet_id)
+        while record is not None and record.version > self.version:
+            record = record.older
+        return record.pet if record is not None else None
+
+    def get_json(self, pet_id):
+        """Returns the pet with the given ID encoded as JSON bytes, or None."""
+        pet = self.get(pet_id)
+        return pet.to_json() if pet is not None else None
+
+    def close(self):
+        if self._open:
+            self._open = False
+            self.store._release_view(self.version)
+
+
+class PetStore:
+    """
+    Keeps pets in memory and looks them up by category, name, gender,
+    availability and birthday.
+
+    A writer holds the stripe lock of the pet it changes while it updates
+    the indexes, so writes to one pet are applied in order.  Locks are
+    always taken in the same order (stripes by number, then IDs, category,
+    fields, names and version) so they can never deadlock.
+
+    Stored pets are never changed in place.  A write publishes a new
+    Record for each pet it touches together with its version bump, keeping
+    the records it replaced only while an open ReadView may still see them;
+    they are reclaimed when the last such view closes.
+    """
+
+    def __init__(self, stripes=DEFAULT_STRIPES, change_log_size=CHANGE_LOG_SIZE):
+        self._stripes = [({}, threading.Lock()) for _ in range(stripes)]
+        self._id_lock = threading.Lock()
+        self._next_id = 1
+        self._epoch = 0     # bumped by reset(), which hands out the same IDs again
+        self._version_lock = threading.Lock()
+        self._version = 0
+        # Ring buffer of (version, kind, pet ID, Pet) change events, guarded
+        # by the version lock.  Events up to _changes_floor may be missing.
+        self._changes = deque(maxlen=change_log_size)
+        self._changes_floor = 0
+        # Versions of the open ReadViews (version -> count), and the
+        # (version, pet ID) of every write that left older records behind
+        # for them, oldest first.  Both are guarded by the version lock.
+        self._readers = {}
+        self._garbage = deque()
+        self._abandoned_views = deque()     # versions of views dropped unclosed
+        # Pet IDs in ascending order, for keyset pagination
+        self._ids_lock = threading.Lock()
+        self._sorted_ids = []
+        # Secondary indexes, keyed by case-folded values.  Pet IDs are kept
+        # in sorted lists, so a page of matches starts with a bisect.
+        self._category_lock = threading.Lock()
+        self._by_category = {}      # category -> pet IDs
+        self._fields_lock = threading.Lock()
+        self._by_gender = {}        # gender -> pet IDs
+        self._by_available = {}     # True or False -> pet IDs
+        self._birthdays = []        # birthday keys in order (range search)
+        self._name_lock = threading.Lock()
+        self._by_name = {}          # name -> pet IDs (exact search)
+        self._sorted_names = []     # distinct names in order (prefix search)
+        self._names_by_ngram = {}   # n-gram -> distinct names (substring search)
+
+    @property
+    def version(self):
+        """A number that grows every time the pets change."""
+        return self._version
+
+    def __len__(self):
+        return len(self._sorted_ids)
+
+    def close(self):
+        """Releases the store's resources; an in-memory store has none."""
+
+    def reserve_ids(self, count=1):
+        """Reserves count consecutive IDs and returns the first one."""
+        return self._reserve_ids(count)[0]
+
+    def get(self, pet_id):
+        """Returns the latest version of the pet with the given ID, or None."""
+        record = self._stripe(pet_id)[0].get(pet_id)
+        return record.pet if record is not None else None
+
+    def get_json(self, pet_id):
+        """Returns the pet with the given ID encoded as JSON bytes, or None."""
+        pet = self.get(pet_id)
+        return pet.to_json() if pet is not None else None
+
+    def read_view(self):
+        """Returns a ReadView of the pets as they are now."""
+        with self._version_lock:
+            abandoned = self._forget_abandoned_views()
+            self._readers[self._version] = self._readers.get(self._version, 0) + 1
+            view = ReadView(self, self._version)
+        if abandoned:
+            self._collect()
+        return view
+
+    def create(self, data):
+        """
+        Stores a new pet from a dict and returns it as a Pet with its ID.
+        Raises DataValidationError if data is not a valid pet.
+        """
+        return self._insert([data])[0]
+
+    def create_many(self, items):
+        """Stores several pets as one change and returns their IDs."""
+        return [pet.id for pet in self._insert(items)]
+
+    def update(self, pet_id, data):
+        """Merges data into a pet and returns the new Pet, or None if missing."""
+        return self._update_many([(pet_id, data)])[0]
+
+    def update_many(self, changes):
+        """
+        Merges each (pet ID, data) pair into its pet as one change and
+        returns the new Pets in order, with None for missing IDs.  Raises
+        DataValidationError, changing nothing, if any data is invalid.
+        """
+        return self._update_many(changes)
+
+    def delete(self, pet_id):
+        """Removes a pet, returning False if it did not exist."""
+        return self._delete_many([pet_id])[0]
+
+    def delete_many(self, pet_ids):
+        """Removes several pets as one change, returning whether each existed."""
+        return self._delete_many(pet_ids)
+
+    def reset(self):
+        """Removes every pet and starts the IDs from 1 again."""
+        with ExitStack() as stack:
+            for pets, lock in self._stripes:
+                stack.enter_context(lock)
+            for lock in (self._ids_lock, self._category_lock, self._fields_lock,
+                         self._name_lock, self._id_lock):
+                stack.enter_context(lock)
+            self._sorted_ids.clear()
+            self._by_category.clear()
+            self._by_gender.clear()
+            self._by_available.clear()
+            self._birthdays.clear()
+            self._by_name.clear()
+            self._sorted_names.clear()
+            self._names_by_ngram.clear()
+            self._next_id = 1
+            self._epoch += 1
+            self._changed('reset', None)
+
+    def stats(self):
+        """
+        Returns the number of pets in total and per category, gender and
+        availability.  The indexes already hold the pets of every group, so
+        this costs one step per group however many pets there are.
+        """
+        with self._category_lock:
+            category = {key: len(ids) for key, ids in sorted(self._by_category.items())}
+        with self._fields_lock:
+            gender = {key: len(ids) for key, ids in sorted(self._by_gender.items())}
+            available = {str(key).lower(): len(ids) for key, ids in sorted(self._by_available.items())}
+        return {'total': len(self), 'category': category, 'gender': gender, 'available': available}
+
+    def changes(self, since):
+        """
+        Returns (version, events) with every change made after version since,
+        oldest first, or (version, None) if they are no longer all known and
+        the caller has to reload everything.
+        """
+        with self._version_lock:
+            # A client ahead of us saw a store that has since been restarted
+            if since < self._changes_floor or since > self._version:
+                return self._version, None
+            events = []
+            for event in reversed(self._changes):
+                if event[0] <= since:
+                    break
+                events.append(event)
+            version = self._version
+        events.reverse()
+        if any(kind == 'reset' for _, kind, _, _ in events):
+            return version, None
+        return version, [change_event(*event) for event in events]
+
+    def find(self, filters=None, after_id=0, limit=None, plan=None, view=None):
+        """
+        Returns (ids, has_more): the IDs of up to limit pets after after_id
+        that match every filter in SEARCH_FIELDS.  Given a dict as plan,
+        it fills it in with how the query was executed.  Given a ReadView
+        as view, the pets are matched as they were at its version.
+
+        The filter whose index matches the fewest pets is scanned in ID
+        order from after_id, and every other filter only checks those
+        candidates, most selective first.  Candidates are read a page at a
+        time, twice as many each round while the other filters leave the
+        page short, so the work follows the size of the page rather than of
+        the store.
+        """
+        filters = {field: filter_key(field, value) for field, value in search_filters(filters or {}).items()}
+        if view is not None:
+            return self._find_in_view(view, filters, after_id, limit, plan)
+        return self._search(filters, after_id, limit, plan)
+
+    ######################################################################
+    # Internal helpers
+    ######################################################################
+
+    def _search(self, filters, after_id, limit, plan):
+        """find() over the latest pets, with filters already turned into keys."""
+        if not filters:
+            with self._ids_lock:
+                start = bisect.bisect_right(self._sorted_ids, after_id)
+                end = len(self._sorted_ids) if limit is None else min(start + limit, len(self._sorted_ids))
+                if plan is not None:
+                    plan.update(index='id', steps=[], rows_scanned=end - start)
+                return self._sorted_ids[start:end], end < len(self._sorted_ids)
+
+        scanned, *probed = sorted(self._conditions(filters), key=lambda condition: condition.rows)
+        steps = [{'filter': scanned.name, 'access': 'index scan', 'rows': 0}]
+        steps += [{'filter': condition.name, 'access': 'probe', 'rows': 0} for condition in probed]
+        # One more than the page tells whether there are more pets after it
+        count = None if limit is None else limit + 1
+        found = []
+        while True:
+            ids = scanned.scan(after_id, count)
+            if not ids:
+                break
+            steps[0]['rows'] += len(ids)
+            after_id = ids[-1]
+            for step, condition in zip(steps[1:], probed):
+                if not ids:
+                    break
+                step['rows'] += len(ids)
+                ids = condition.probe(ids)
+            found += ids
+            if count is None or len(found) > limit:
+                break
+            count *= 2
+        if plan is not None:
+            plan.update(index=scanned.name, steps=steps,
+                        rows_scanned=sum(step['rows'] for step in steps))
+        if limit is None:
+            return found, False
+        return found[:limit], len(found) > limit
+
+    def _find_in_view(self, view, filters, after_id, limit, plan):
+        """
+        find() as of a ReadView's version.  The indexes only hold the latest
+        pets, so their matches are kept only for pets unchanged since the
+        view's version, and the pets changed or deleted after it are matched
+        as the view sees them.
+        """
+        start, found, rows = after_id, [], 0
+        while True:
+            page_plan = {}
+            ids, has_more = self._search(filters, after_id, limit, page_plan)
+            rows += page_plan['rows_scanned']
+            found += [pet_id for pet_id in ids if self._unchanged_since(pet_id, view.version)]
+            if not has_more:
+                after_id = None
+                break
+            after_id = ids[-1]
+            if len(found) > limit:
+                break
+        # Looked up after the search, so a pet changed during it is not missed
+        for pet_id in self._changed_since(view.version):
+            if pet_id > start and (after_id is None or pet_id <= after_id):
+                pet = view.get(pet_id)
+                if pet is not None and matches_filters(pet, filters):
+                    found.append(pet_id)
+        found = sorted(set(found))
+        if plan is not None:
+            plan.update(page_plan, rows_scanned=rows)
+        if limit is None:
+            return found, False
+        return found[:limit], len(found) > limit
+
+    def _unchanged_since(self, pet_id, version):
+        """Tells whether a pet exists and has not changed after version."""
+        record = self._stripe(pet_id)[0].get(pet_id)
+        return record is not None and record.version <= version and record.pet is not None
+
+    def _changed_since(self, version):
+        """
+        Returns the IDs of the pets changed or deleted after version.  An
+        open ReadView at version keeps these in the garbage list.
+        """
+        changed = set()
+        with self._version_lock:
+            for change_version, pet_id in reversed(self._garbage):
+                if change_version <= version:
+                    break
+                changed.add(pet_id)
+        return changed
+
+    def _stripe(self, pet_id):
+        """Returns the (pets, lock) stripe that holds a pet ID."""
+        return self._stripes[pet_id % len(self._stripes)]
+
+    def _lock_stripes(self, stack, pet_ids):
+        """Takes the locks of the stripes that hold the pet IDs, in order."""
+        for number in sorted({pet_id % len(self._stripes) for pet_id in pet_ids}):
+            stack.enter_context(self._stripes[number][1])
+
+    def _changed(self, kind, data):
+        """
+        Records a change and publishes it to readers while the writer still
+        holds its locks.  The new records appear together with the new
+        version, so a ReadView sees either all of a change or none of it.
+
+        kind is 'create' or 'update' (data is the new Pets), 'delete' (the
+        removed Pets) or 'reset' (None).  Subclasses extend this to keep
+        other records of the changes.
+        """
+        with self._version_lock:
+            self._version += 1
+            self._publish(kind, data)
+            if kind in ('create', 'update'):
+                events = [(self._version, kind, pet.id, pet) for pet in data]
+            elif kind == 'delete':
+                events = [(self._version, kind, pet.id, None) for pet in data]
+            else:
+                events = [(self._version, kind, None, None)]
+            for event in events:
+                if len(self._changes) == self._changes.maxlen:
+                    self._changes_floor = self._changes[0][0]
+                self._changes.append(event)
+
+    def _publish(self, kind, data):
+        """Stores the records of a change at the current version, under the version lock."""
+        # Writers forget dropped views too, or a stretch of writes with no
+        # reads would keep every version those views pinned
+        self._forget_abandoned_views()
+        oldest = min(self._readers) if self._readers else None
+        if kind in ('create', 'update'):
+            for pet in data:
+                self._put(pet.id, pet, oldest)
+        elif kind == 'delete':
+            for pet in data:
+                self._put(pet.id, None, oldest)
+        elif oldest is None:
+            for pets, _ in self._stripes:
+                pets.clear()
+        else:
+            for pets, _ in self._stripes:
+                for pet_id, record in list(pets.items()):
+                    if record.pet is not None:
+                        self._put(pet_id, None, oldest)
+
+    def _put(self, pet_id, pet, oldest):
+        """Makes pet (None for deleted) the latest version of a pet ID."""
+        pets = self._stripe(pet_id)[0]
+        if oldest is None:  # no reader can see the old version
+            if pet is None:
+                pets.pop(pet_id, None)
+            else:
+                pets[pet_id] = Record(self._version, pet)
+            return
+        older = pets.get(pet_id)
+        pets[pet_id] = Record(self._version, pet, prune(older, oldest) if older else None)
+        if older is not None or pet is None:
+            self._garbage.append((self._version, pet_id))
+
+    def _release_view(self, version):
+        """Forgets a closed ReadView and reclaims the records nobody can see any more."""
+        with self._version_lock:
+            self._forget_reader(version)
+            self._forget_abandoned_views()
+        self._collect()
+
+    def _forget_reader(self, version):
+        if self._readers[version] == 1:
+            del self._readers[version]
+        else:
+            self._readers[version] -= 1
+
+    def _forget_abandoned_views(self):
+        """Forgets the views dropped without being closed, returning how many there were."""
+        count = 0
+        while self._abandoned_views:
+            self._forget_reader(self._abandoned_views.popleft())
+            count += 1
+        return count
+
+    def _collect(self):
+        """Reclaims the records that no open ReadView can see."""
+        with self._version_lock:
+            oldest = min(self._readers) if self._readers else None
+            garbage = []
+            while self._garbage and (oldest is None or self._garbage[0][0] <= oldest):
+                garbage.append(self._garbage.popleft()[1])
+        for pet_id in garbage:
+            pets, lock = self._stripe(pet_id)
+            with lock:
+                record = pets.get(pet_id)
+                if record is None:
+                    continue
+                # Views may have opened meanwhile, so look at them again
+                with self._version_lock:
+                    oldest = min(self._readers) if self._readers else None
+                if record.pet is None and (oldest is None or record.version <= oldest):
+                    del pets[pet_id]
+                elif oldest is None:
+                    record.older = None
+                else:
+                    prune(record, oldest)
+
+    def _forget_changes(self):
+        """Drops the change events, e.g. after loading pets from elsewhere."""
+        with self._version_lock:
+            self._changes.clear()
+            self._changes_floor = self._version
+
+    def _reserve_ids(self, count):
+        """Reserves count consecutive IDs, returning the first one and the current epoch."""
+        with self._id_lock:
+            first_id = self._next_id
+            self._next_id += count
+            return first_id, self._epoch
+
+    def _insert(self, items):
+        """Stores new pets under one reservation of IDs and one version bump."""
+        while True:
+            new_pets = [Pet.from_dict(data) for data in items]
+            first_id, epoch = self._reserve_ids(len(new_pets))
+            for pet_id, pet in enumerate(new_pets, start=first_id):
+                pet.id = pet_id     # not yet visible to other threads
+                pet.to_json()       # encoded once when written, not on every read
+            if self._store(new_pets, epoch):
+                return new_pets
+            # A reset between the reservation and the store may hand out
+            # these IDs again, so the pets get new ones
+
+    def _store(self, new_pets, epoch=None):
+        """
+        Adds pets that already have ascending IDs as one change.  Given the
+        epoch their IDs were reserved in, it adds nothing and returns False
+        if reset() has run since.
+        """
+        with ExitStack() as stack:
+            self._lock_stripes(stack, [pet.id for pet in new_pets])
+            # reset() holds every stripe lock, so the epoch cannot move from here on
+            if epoch is not None and epoch != self._epoch:
+                return False
+            with self._ids_lock:
+                if not self._sorted_ids or not new_pets or self._sorted_ids[-1] < new_pets[0].id:
+                    self._sorted_ids.extend(pet.id for pet in new_pets)
+                else:   # a concurrent writer got a later block in first
+                    for pet in new_pets:
+                        bisect.insort(self._sorted_ids, pet.id)
+            self._index(new_pets)
+            self._changed('create', new_pets)
+            return True
+
+    def _update_many(self, changes):
+        """Applies (pet ID, data) updates with one index pass and one version bump."""
+        changes = list(changes)
+        with ExitStack() as stack:
+            self._lock_stripes(stack, [pet_id for pet_id, _ in changes])
+            updated = {}    # pet ID -> [Pet before the batch, latest new Pet]
+            results = []
+            for pet_id, data in changes:
+                old_pet = updated[pet_id][1] if pet_id in updated else self.get(pet_id)
+                if old_pet is None:
+                    results.append(None)
+                    continue
+                pet = old_pet.updated(data)
+                updated.setdefault(pet_id, [old_pet, None])[1] = pet
+                results.append(pet)
+            if updated:
+                new_pets = [pet for _, pet in updated.values()]
+                for pet in new_pets:
+                    pet.to_json()   # encoded once when written, not on every read
+                self._unindex([old_pet for old_pet, _ in updated.values()])
+                self._index(new_pets)
+                self._changed('update', new_pets)
+            return results
+
+    def _delete_many(self, pet_ids):
+        """Removes pets with one index pass and one version bump."""
+        pet_ids = list(pet_ids)
+        with ExitStack() as stack:
+            self._lock_stripes(stack, pet_ids)
+            removed = {}
+            for pet_id in pet_ids:
+                pet = self.get(pet_id)
+                if pet is not None:
+                    removed[pet_id] = pet
+            if removed:
+                with self._ids_lock:
+                    # Past a few IDs, one pass over the list beats a memmove per ID
+                    if len(removed) <= 16:
+                        for pet_id in removed:
+                            del self._sorted_ids[bisect.bisect_left(self._sorted_ids, pet_id)]
+                    else:
+                        self._sorted_ids[:] = [pet_id for pet_id in self._sorted_ids if pet_id not in removed]
+                self._unindex(list(removed.values()))
+                self._changed('delete', list(removed.values()))
+            return [pet_id in removed for pet_id in pet_ids]
+
+    def _index(self, pets):
+        """Adds pets to the secondary indexes."""
+        with self._category_lock:
+            for pet in pets:
+                if pet.category is not None:
+                    add_to_index(self._by_category, index_key(pet.category), pet.id)
+        with self._fields_lock:
+            for pet in pets:
+                if pet.gender is not None:
+                    add_to_index(self._by_gender, index_key(pet.gender), pet.id)
+                if pet.available is not None:
+                    add_to_index(self._by_available, pet.available, pet.id)
+                if pet.birthday_ordinal is not None:
+                    bisect.insort(self._birthdays, pet.birthday_ordinal << BIRTHDAY_SHIFT | pet.id)
+        with self._name_lock:
+            for pet in pets:
+                if pet.name is None:
+                    continue
+                name = index_key(pet.name)
+                if add_to_index(self._by_name, name, pet.id):
+                    bisect.insort(self._sorted_names, name)
+                    for gram in ngrams(name):
+                        self._names_by_ngram.setdefault(gram, set()).add(name)
+
+    def _unindex(self, pets):
+        """Removes pets from the secondary indexes."""
+        with self._category_lock:
+            for pet in pets:
+                if pet.category is not None:
+                    remove_from_index(self._by_category, index_key(pet.category), pet.id)
+        with self._fields_lock:
+            for pet in pets:
+                if pet.gender is not None:
+                    remove_from_index(self._by_gender, index_key(pet.gender), pet.id)
+                if pet.available is not None:
+                    remove_from_index(self._by_available, pet.available, pet.id)
+                if pet.birthday_ordinal is not None:
+                    key = pet.birthday_ordinal << BIRTHDAY_SHIFT | pet.id
+                    del self._birthdays[bisect.bisect_left(self._birthdays, key)]
+        with self._name_lock:
+            for pet in pets:
+                if pet.name is None:
+                    continue
+                name = index_key(pet.name)
+                if remove_from_index(self._by_name, name, pet.id):
+                    del self._sorted_names[bisect.bisect_left(self._sorted_names, name)]
+                    for gram in ngrams(name):
+                        names = self._names_by_ngram[gram]
+                        names.discard(name)
+                        if not names:
+                            del self._names_by_ngram[gram]
+
+    def _conditions(self, filters):
+        """Returns a Condition for each filter, with the birthday bounds as one range."""
+        conditions = []
+        hash_indexes = {
+            'category': (self._by_category, self._category_lock),
+            'gender': (self._by_gender, self._fields_lock),
+            'available': (self._by_available, self._fields_lock),
+            'name': (self._by_name, self._name_lock),
+        }
+        for field, key in filters.items():
+            if field in hash_indexes:
+                index, lock = hash_indexes[field]
+                conditions.append(self._hash_condition(field, index, lock, key))
+            elif field in ('name_prefix', 'name_contains'):
+                with self._name_lock:
+                    names = (self._names_with_prefix(key) if field == 'name_prefix'
+                             else self._names_containing(key))
+                    matches = {pet_id for name in names for pet_id in self._by_name[name]}
+                conditions.append(self._set_condition(field, matches))
+        if 'birthday_from' in filters or 'birthday_to' in filters:
+            conditions.append(self._birthday_condition(filters.get('birthday_from'),
+                                                       filters.get('birthday_to')))
+        return conditions
+
+    def _hash_condition(self, field, index, lock, key):
+        """Returns the Condition of an exact match in a hash index."""
+        def scan(after_id, count):
+            with lock:
+                return ids_after(index.get(key, ()), after_id, count)
+
+        def probe(ids):
+            # The index may hold many pets, so it is checked in place, not copied
+            with lock:
+                matches = index.get(key, ())
+                return [pet_id for pet_id in ids if contains(matches, pet_id)]
+
+        with lock:
+            rows = len(index.get(key, ()))
+        return Condition(field, rows, scan, probe)
+
+    def _birthday_condition(self, first, last):
+        """Returns the Condition of a range of birthday ordinals, either end open."""
+        low = 0 if first is None else first << BIRTHDAY_SHIFT
+        high = float('inf') if last is None else last << BIRTHDAY_SHIFT | ID_MASK
+        first = float('-inf') if first is None else first
+        last = float('inf') if last is None else last
+
+        def bounds():
+            return (bisect.bisect_left(self._birthdays, low),
+                    bisect.bisect_right(self._birthdays, high))
+
+        in_order = []
+
+        def scan(after_id, count):
+            # The index is in birthday order, so the IDs are sorted once per search
+            if not in_order:
+                with self._fields_lock:
+                    start, end = bounds()
+                    in_order.extend(sorted(key & ID_MASK for key in self._birthdays[start:end]))
+            return ids_after(in_order, after_id, count)
+
+        def probe(ids):
+            pets = (self.get(pet_id) for pet_id in ids)
+            return [pet.id for pet in pets if pet is not None and pet.birthday_ordinal is not None
+                    and first <= pet.birthday_ordinal <= last]
+
+        with self._fields_lock:
+            start, end = bounds()
+        return Condition('birthday', end - start, scan, probe)
+
+    def _set_condition(self, field, matches):
+        """Returns the Condition of a set of pet IDs gathered from several index entries."""
+        in_order = []
+
+        def scan(after_id, count):
+            if not in_order:
+                in_order.extend(sorted(matches))
+            return ids_after(in_order, after_id, count)
+
+        return Condition(field, len(matches), scan, lambda ids: [i for i in ids if i in matches])
+
+    def _names_with_prefix(self, prefix):
+        """Returns the indexed names that start with prefix."""
+        names = []
+        for i in range(bisect.bisect_left(self._sorted_names, prefix), len(self._sorted_names)):
+            if not self._sorted_names[i].startswith(prefix):
+                break
+            names.append(self._sorted_names[i])
+        return names
+
+    def _names_containing(self, text):
+        """Returns the indexed names that contain text."""
+        if len(text) <= NGRAM_SIZE:
+            return list(self._names_by_ngram.get(text, ()))
+        grams = [text[i:i + NGRAM_SIZE] for i in range(len(text) - NGRAM_SIZE + 1)]
+        candidates = sorted((self._names_by_ngram.get(gram, set()) for gram in grams), key=len)
+        return [name for name in candidates[0].intersection(*candidates[1:]) if text in name]
+
+
+def change_event(version, kind, pet_id, pet):
+    """Builds the JSON-ready form of a change event."""
+    event = {'version': version, 'type': kind, 'id': pet_id}
+    if pet is not None:
+        event['pet'] = pet.to_dict()
+    return event
+
+
+def create_store(backend='memory', **options):
+    """
+    Creates the store for a backend name: 'memory' (the default) or 'sqlite'.
+
+    Options are passed to the store, e.g. path='pets.db' for SQLite.  A
+    memory store given log_dir keeps a write-ahead log and snapshots there.
+    """
+    if backend == 'memory':
+        if options.get('log_dir'):
+            from petlog import LoggedPetStore
+            return LoggedPetStore(options.pop('log_dir'), **options)
+        options.pop('log_dir', None)
+        return PetStore(**options)
+    if backend == 'sqlite':
+        from sqlite_store import SqlitePetStore
+        return SqlitePetStore(**options)
+    raise ValueError(f"Unknown pet store backend: {backend}")
@@ -0,0 +1,484 @@
+# sqlite_store.py
+"""
+A SQLite-backed store for the pet shop.
+
+It has the same methods as the in-memory PetStore, so the routes do not
+care which one they talk to.  The database runs in WAL mode so readers
+never block the writer, and every thread gets its own connection.
+
+IDs and the version live in the database too, so several worker processes
+pointed at the same file share one consistent store.
+"""
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pet import Pet
+from petstore import CHANGE_LOG_SIZE, change_event, filter_key, index_key, search_filters
+
+# Seconds a connection waits for another writer before giving up
+BUSY_TIMEOUT = 30
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pets (
+    id INTEGER PRIMARY KEY,
+    category_key TEXT,
+    name_key TEXT,
+    available INTEGER,
+    data TEXT NOT NULL,
+    gender_key TEXT,
+    birthday INTEGER
+);
+CREATE TABLE IF NOT EXISTS changes (
+    seq INTEGER PRIMARY KEY,
+    version INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    pet_id INTEGER,
+    data TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_changes_version ON changes (version);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('next_id', 1), ('version', 0), ('changes_floor', 0);
+"""
+
+# Created once any columns missing from an older database have been added
+INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_pets_category ON pets (category_key, id);
+CREATE INDEX IF NOT EXISTS idx_pets_name ON pets (name_key, id);
+CREATE INDEX IF NOT EXISTS idx_pets_available ON pets (available, id);
+CREATE INDEX IF NOT EXISTS idx_pets_gender ON pets (gender_key, id);
+CREATE INDEX IF NOT EXISTS idx_pets_birthday ON pets (birthday, id);
+"""
+
+# The number of pets in total and per category, gender and availability, kept up to
+# date by triggers so GET /pets/stats reads one row per group instead of
+# scanning the pets.  Each statement runs on its own, so that a database
+# made by an older version can get the table and its first counts in one
+# transaction.
+COUNTERS = (
+    """CREATE TABLE pet_counts (
+    field TEXT NOT NULL,
+    value NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (field, value)
+)""",
+    """CREATE TRIGGER pets_count_insert AFTER INSERT ON pets BEGIN
+    INSERT INTO pet_counts (field, value, count) VALUES ('total', '', 1)
+        ON CONFLICT (field, value) DO UPDATE SET count = count + 1;
+    INSERT INTO pet_counts (field, value, count) SELECT 'category', NEW.category_key, 1
+        WHERE NEW.category_key IS NOT NULL ON CONFLICT (field, value) DO UPDATE SET count = count + 1;
+    INSERT INTO pet_counts (field, value, count) SELECT 'gender', NEW.gender_key, 1
+        WHERE NEW.gender_key IS NOT NULL ON CONFLICT (field, value) DO UPDATE SET count = count + 1;
+    INSERT INTO pet_counts (field, value, count) SELECT 'available', NEW.available, 1
+        WHERE NEW.available IS NOT NULL ON CONFLICT (field, value) DO UPDATE SET count = count + 1;
+END""",
+    """CREATE TRIGGER pets_count_delete AFTER DELETE ON pets BEGIN
+    UPDATE pet_counts SET count = count - 1 WHERE field = 'total';
+    UPDATE pet_counts SET count = count - 1 WHERE field = 'category' AND value = OLD.category_key;
+    UPDATE pet_counts SET count = count - 1 WHERE field = 'gender' AND value = OLD.gender_key;
+    UPDATE pet_counts SET count = count - 1 WHERE field = 'available' AND value = OLD.available;
+    DELETE FROM pet_counts WHERE count = 0;
+END""",
+    """CREATE TRIGGER pets_count_update AFTER UPDATE ON pets BEGIN
+    UPDATE pet_counts SET count = count - 1
+        WHERE field = 'category' AND value = OLD.category_key AND OLD.category_key IS NOT NEW.category_key;
+    UPDATE pet_counts SET count = count - 1
+        WHERE field = 'gender' AND value = OLD.gender_key AND OLD.gender_key IS NOT NEW.gender_key;
+    UPDATE pet_counts SET count = count - 1
+        WHERE field = 'available' AND value = OLD.available AND OLD.available IS NOT NEW.available;
+    INSERT INTO pet_counts (field, value, count) SELECT 'category', NEW.category_key, 1
+        WHERE NEW.category_key IS NOT NULL AND OLD.category_key IS NOT NEW.category_key ON CONFLICT (field, value) DO UPDATE SET count = count + 1;
+    INSERT INTO pet_counts (field, value, count) SELECT 'gender', NEW.gender_key, 1
+        WHERE NEW.gender_key IS NOT NULL AND OLD.gender_key IS NOT NEW.gender_key ON CONFLICT (field, value) DO UPDATE SET count = count + 1;
+    INSERT INTO pet_counts (field, value, count) SELECT 'available', NEW.available, 1
+        WHERE NEW.available IS NOT NULL AND OLD.available IS NOT NEW.available ON CONFLICT (field, value) DO UPDATE SET count = count + 1;
+    DELETE FROM pet_counts WHERE count = 0;
+END""",
+    """INSERT INTO pet_counts (field, value, count)
+    SELECT 'total', '', COUNT(*) FROM pets HAVING COUNT(*) > 0
+    UNION ALL
+    SELECT 'category', category_key, COUNT(*) FROM pets WHERE category_key IS NOT NULL GROUP BY category_key
+    UNION ALL
+    SELECT 'gender', gender_key, COUNT(*) FROM pets WHERE gender_key IS NOT NULL GROUP BY gender_key
+    UNION ALL
+    SELECT 'available', available, COUNT(*) FROM pets WHERE available IS NOT NULL GROUP BY available""",
+)
+
+# Columns in the order pet_row() returns them
+COLUMNS = ('id', 'category_key', 'name_key', 'available', 'data', 'gender_key', 'birthday')
+
+# WHERE clauses for each search filter, all over case-folded columns.
+# The SQL text only depends on which filters are used, so sqlite3's
+# per-connection statement cache reuses the prepared statements.
+FILTERS = {
+    'category': "category_key = ?",
+    'name': "name_key = ?",
+    'name_prefix': "name_key >= ? AND name_key < ?",
+    'name_contains': "instr(name_key, ?) > 0",
+    'gender': "gender_key = ?",
+    'available': "available = ?",
+    'birthday_from': "birthday >= ?",
+    'birthday_to': "birthday <= ?",
+}
+
+
+def pet_row(pet):
+    """Returns the column values stored for a Pet."""
+    return (
+        pet.id,
+        index_key(pet.category) if pet.category is not None else None,
+        index_key(pet.name) if pet.name is not None else None,
+        int(pet.available) if pet.available is not None else None,
+        pet.to_json().decode(),
+        index_key(pet.gender) if pet.gender is not None else None,
+        pet.birthday_ordinal,
+    )
+
+
+class SqliteReadView:
+    """
+    The pets as they were at one version of a SqlitePetStore.
+
+    It holds a read transaction on a read connection of the store, which
+    WAL mode keeps on one snapshot of the database without blocking the
+    writer.  The connection may move between threads, but only one may use
+    it at a time, and it goes back to the store when the view is closed.
+    """
+
+    def __init__(self, store):
+        self._db = None
+        self._store = store
+        self._db = store._take_reader()
+        self._db.execute("BEGIN")
+        self.version = store._meta(self._db, 'version')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+    def get(self, pet_id):
+        """Returns the pet with the given ID as of this view's version, or None."""
+        pet_json = self.get_json(pet_id)
+        return Pet.from_dict(json.loads(pet_json)) if pet_json is not None else None
+
+    def get_json(self, pet_id):
+        """Returns the pet with the given ID encoded as JSON bytes, or None."""
+        row = self._db.execute("SELECT data FROM pets WHERE id = ?", (pet_id,)).fetchone()
+        return row[0].encode() if row else None
+
+    def close(self):
+        if self._db is not None:
+            db, self._db = self._db, None
+            db.execute("COMMIT")
+            self._store._return_reader(db)
+
+
+class SqlitePetStore:
+    """
+    Keeps pets in a SQLite database file.
+
+    Writes run in BEGIN IMMEDIATE transactions, so IDs and versions are
+    handed out by the database itself and stay unique across threads.
+    Searches are planned by SQLite itself over one index per filter.
+    """
+
+    def __init__(self, path='pets.db', change_log_size=CHANGE_LOG_SIZE):
+        self.path = path
+        self.change_log_size = change_log_size
+        self._local = threading.local()
+        db = self._connection()
+        db.executescript(SCHEMA)
+        self._add_missing_columns(db)
+        db.executescript(INDEXES)
+        self._add_counters(db)
+
+    @property
+    def version(self):
+        """A number that grows every time the pets change."""
+        return self._meta(self._connection(), 'version')
+
+    def __len__(self):
+        row = self._connection().execute("SELECT count FROM pet_counts WHERE field = 'total'").fetchone()
+        return row[0] if row else 0
+
+    def close(self):
+        """Closes this thread's connections."""
+        for name in ('db', 'reader'):
+            db = getattr(self._local, name, None)
+            if db is not None:
+                db.close()
+                setattr(self._local, name, None)
+
+    def reserve_ids(self, count=1):
+        """Reserves count consecutive IDs and returns the first one."""
+        with self._write() as db:
+            return self._reserve_ids(db, count)
+
+    def get(self, pet_id):
+        """Returns the pet with the given ID, or None."""
+        row = self._connection().execute("SELECT data FROM pets WHERE id = ?", (pet_id,)).fetchone()
+        return Pet.from_dict(json.loads(row[0])) if row else None
+
+    def get_json(self, pet_id):
+        """Returns the pet with the given ID encoded as JSON bytes, or None."""
+        row = self._connection().execute("SELECT data FROM pets WHERE id = ?", (pet_id,)).fetchone()
+        return row[0].encode() if row else None
+
+    def read_view(self):
+        """Returns a SqliteReadView of the pets as they are now."""
+        return SqliteReadView(self)
+
+    def create(self, data):
+        """
+        Stores a new pet from a dict and returns it as a Pet with its ID.
+        Raises DataValidationError if data is not a valid pet.
+        """
+        return self._insert([data])[0]
+
+    def create_many(self, items):
+        """Stores several pets as one change and returns their IDs."""
+        return [pet.id for pet in self._insert(items)]
+
+    def update(self, pet_id, data):
+        """Merges data into a pet and returns the new Pet, or None if missing."""
+        return self.update_many([(pet_id, data)])[0]
+
+    def update_many(self, changes):
+        """
+        Merges each (pet ID, data) pair into its pet as one change and
+        returns the new Pets in order, with None for missing IDs.  Raises
+        DataValidationError, changing nothing, if any data is invalid.
+        """
+        changes = list(changes)
+        with self._write() as db:
+            pets = {pet_id: Pet.from_dict(json.loads(data))
+                    for pet_id, data in self._select(db, [pet_id for pet_id, _ in changes])}
+            updated = {}
+            results = []
+            for pet_id, data in changes:
+                pet = pets.get(pet_id)
+                if pet is not None:
+                    pet = pets[pet_id] = updated[pet_id] = pet.updated(data)
+                results.append(pet)
+            if updated:
+                db.executemany(
+                    f"UPDATE pets SET {', '.join(column + ' = ?' for column in COLUMNS[1:])} WHERE id = ?",
+                    [pet_row(pet)[1:] + (pet.id,) for pet in updated.values()])
+                self._changed(db, [('update', pet.id, pet) for pet in updated.values()])
+            return results
+
+    def delete(self, pet_id):
+        """Removes a pet, returning False if it did not exist."""
+        return self.delete_many([pet_id])[0]
+
+    def delete_many(self, pet_ids):
+        """Removes several pets as one change, returning whether each existed."""
+        pet_ids = list(pet_ids)
+        with self._write() as db:
+            found = {pet_id for pet_id, _ in self._select(db, pet_ids)}
+            if found:
+                db.executemany("DELETE FROM pets WHERE id = ?", [(pet_id,) for pet_id in found])
+                self._changed(db, [('delete', pet_id, None) for pet_id in sorted(found)])
+            return [pet_id in found for pet_id in pet_ids]
+
+    def reset(self):
+        """Removes every pet and starts the IDs from 1 again."""
+        with self._write() as db:
+            db.execute("DELETE FROM pets")
+            db.execute("UPDATE meta SET value = 1 WHERE key = 'next_id'")
+            self._changed(db, [('reset', None, None)])
+
+    def stats(self):
+        """
+        Returns the number of pets in total and per category, gender and
+        availability, read from the counters the triggers keep.
+        """
+        rows = self._connection().execute("SELECT field, value, count FROM pet_counts ORDER BY field, value")
+        stats = {'total': 0, 'category': {}, 'gender': {}, 'available': {}}
+        for field, value, count in rows:
+            if field == 'total':
+                stats['total'] = count
+            elif field == 'available':
+                stats['available']['true' if value else 'false'] = count
+            else:
+                stats[field][value] = count
+        return stats
+
+    def changes(self, since):
+        """
+        Returns (version, events) with every change made after version since,
+        oldest first, or (version, None) if they are no longer all known and
+        the caller has to reload everything.
+        """
+        db = self._connection()
+        db.execute("BEGIN")     # one snapshot for the version and the events
+        try:
+            version = self._meta(db, 'version')
+            if since < self._meta(db, 'changes_floor') or since > version:
+                return version, None
+            rows = db.execute(
+                "SELECT version, type, pet_id, data FROM changes WHERE version > ? ORDER BY seq",
+                (since,)).fetchall()
+        finally:
+            db.execute("COMMIT")
+        if any(kind == 'reset' for _, kind, _, _ in rows):
+            return version, None
+        return version, [change_event(change_version, kind, pet_id,
+                                      Pet.from_dict(json.loads(data)) if data else None)
+                         for change_version, kind, pet_id, data in rows]
+
+    def find(self, filters=None, after_id=0, limit=None, plan=None, view=None):
+        """
+        Returns (ids, has_more): the IDs of up to limit pets after after_id
+        that match every filter in SEARCH_FIELDS.  Given a dict as plan,
+        it fills it in with SQLite's query plan.  Given a SqliteReadView as
+        view, the search runs in its transaction, at its version.
+        """
+        clauses = ["id > ?"]
+        params = [after_id]
+        for field, value in search_filters(filters or {}).items():
+            key = filter_key(field, value)
+            clauses.append(FILTERS[field])
+            params.extend([key, key + '\U0010ffff'] if field == 'name_prefix' else [key])
+        sql = f"SELECT id FROM pets WHERE {' AND '.join(clauses)} ORDER BY id"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit + 1)    # one extra row tells us if there is more
+        db = self._connection() if view is None else view._db
+        if plan is not None:
+            steps = [row[3] for row in db.execute("EXPLAIN QUERY PLAN " + sql, params)]
+            plan.update(index=steps[0] if steps else None, steps=steps)
+        ids = [row[0] for row in db.execute(sql, params)]
+        if limit is not None and len(ids) > limit:
+            return ids[:limit], True
+        return ids, False
+
+    ######################################################################
+    # Internal helpers
+    ######################################################################
+
+    def _connection(self):
+        """Returns this thread's connection, opening it on first use."""
+        db = getattr(self._local, 'db', None)
+        # A connection must not be used on both sides of a fork, so a worker
+        # forked from a process that already had one opens its own
+        if db is None or self._local.pid != os.getpid():
+            db = self._connect()
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    def _take_reader(self):
+        """
+        Returns this thread's read connection for a SqliteReadView, opening
+        one on first use.  While a view holds it, further views get
+        connections of their own.
+        """
+        db = getattr(self._local, 'reader', None)
+        self._local.reader = None
+        # Like _connection(), a worker forked with a connection opens its own
+        if db is not None and self._local.reader_pid == os.getpid():
+            return db
+        return self._connect(check_same_thread=False)
+
+    def _return_reader(self, db):
+        """Keeps a closed view's connection for the next view of this thread."""
+        if getattr(self._local, 'reader', None) is None:
+            self._local.reader = db
+            self._local.reader_pid = os.getpid()
+        else:
+            db.close()
+
+    def _connect(self, **options):
+        db = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, isolation_level=None, **options)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    @contextmanager
+    def _write(self):
+        """Runs a block in a write transaction that commits unless it raises."""
+        db = self._connection()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def _add_missing_columns(self, db):
+        """Adds the search columns a database made by an older version lacks."""
+        present = {row[1] for row in db.execute("PRAGMA table_info(pets)")}
+        missing = [column for column in ('gender_key', 'birthday') if column not in present]
+        if not missing:
+            return
+        with self._write() as db:
+            for column in missing:
+                db.execute(f"ALTER TABLE pets ADD COLUMN {column} {'INTEGER' if column == 'birthday' else 'TEXT'}")
+            pets = [Pet.from_dict(json.loads(data)) for (data,) in db.execute("SELECT data FROM pets")]
+            db.executemany("UPDATE pets SET gender_key = ?, birthday = ? WHERE id = ?",
+                           [pet_row(pet)[5:] + (pet.id,) for pet in pets])
+
+    def _select(self, db, pet_ids):
+        """Returns the (id, data) rows of the pets with the given IDs that exist."""
+        pet_ids = list(dict.fromkeys(pet_ids))
+        rows = []
+        # SQLite limits the number of parameters in one statement
+        for start in range(0, len(pet_ids), 500):
+            chunk = pet_ids[start:start + 500]
+            rows += db.execute(f"SELECT id, data FROM pets WHERE id IN ({', '.join('?' * len(chunk))})",
+                               chunk).fetchall()
+        return rows
+
+    def _add_counters(self, db):
+        """Creates and fills the pet_counts table if the database does not have it yet."""
+        with self._write() as db:
+            if not db.execute("SELECT 1 FROM sqlite_master WHERE name = 'pet_counts'").fetchone():
+                for statement in COUNTERS:
+                    db.execute(statement)
+
+    def _meta(self, db, key):
+        return db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()[0]
+
+    def _reserve_ids(self, db, count):
+        first_id = self._meta(db, 'next_id')
+        db.execute("UPDATE meta SET value = value + ? WHERE key = 'next_id'", (count,))
+        return first_id
+
+    def _changed(self, db, events):
+        """Bumps the version and records (kind, pet ID, Pet) change events."""
+        db.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+        version = self._meta(db, 'version')
+        db.executemany(
+            "INSERT INTO changes (version, type, pet_id, data) VALUES (?, ?, ?, ?)",
+            [(version, kind, pet_id, json.dumps(pet.to_dict()) if pet else None)
+             for kind, pet_id, pet in events])
+        # Like a ring buffer, only the newest change_log_size events are kept
+        cutoff = db.execute("SELECT MAX(seq) FROM changes").fetchone()[0] - self.change_log_size
+        floor = db.execute("SELECT MAX(version) FROM changes WHERE seq <= ?", (cutoff,)).fetchone()[0]
+        if floor is not None:
+            db.execute("UPDATE meta SET value = ? WHERE key = 'changes_floor'", (floor,))
+            db.execute("DELETE FROM changes WHERE seq <= ?", (cutoff,))
+
+    def _insert(self, items):
+        """Stores new pets under one reservation of IDs and one version bump."""
+        new_pets = [Pet.from_dict(data) for data in items]
+        with self._write() as db:
+            first_id = self._reserve_ids(db, len(new_pets))
+            for pet_id, pet in enumerate(new_pets, start=first_id):
+                pet.id = pet_id
+            db.executemany(
+                f"INSERT INTO pets ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                map(pet_row, new_pets))
+            self._changed(db, [('create', pet.id, pet) for pet in new_pets])
+        return new_pets
@@ -0,0 +1,92 @@
+import threading
+import unittest
+from admission import CHEAP, EXPENSIVE, AdmissionController
+
+class AdmissionControllerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.started = []
+        self.controller = AdmissionController(self.app, lambda environ: environ['kind'],
+                                              max_concurrent=2, queue_timeout=5, max_queue=2)
+
+    def app(self, environ, start_response):
+        self.started.append(environ['name'])
+        start_response('200 OK', [])
+        return [b'ok']
+
+    def call(self, name, kind):
+        """Calls the controller, returning (status, headers, body) with the body still open."""
+        response = {}
+        def start_response(status, headers, exc_info=None):
+            response['status'], response['headers'] = status, dict(headers)
+        body = self.controller({'name': name, 'kind': kind}, start_response)
+        return response['status'], response['headers'], body
+
+    def call_in_thread(self, name, kind):
+        """Starts a request that may have to wait for a slot, returning its thread and results."""
+        results = []
+        thread = threading.Thread(target=lambda: results.append(self.call(name, kind)))
+        thread.start()
+        return thread, results
+
+    def wait_until_queued(self, count):
+        while self.controller.queued < count:
+            threading.Event().wait(0.001)
+
+    def test_requests_wait_for_a_slot(self):
+        """Test that a request over the limit runs once a running one finishes."""
+        _, _, first = self.call('first', CHEAP)
+        _, _, second = self.call('second', CHEAP)
+        thread, results = self.call_in_thread('third', CHEAP)
+        self.wait_until_queued(1)
+        self.assertEqual(self.started, ['first', 'second'])
+
+        first.close()
+        thread.join()
+        self.assertEqual(results[0][0], '200 OK')
+        self.assertEqual(self.started, ['first', 'second', 'third'])
+        self.assertEqual(self.controller.active, 2)
+
+    def test_full_queue_is_rejected(self):
+        """Test that requests beyond the queue are turned away at once."""
+        self.controller.max_queue = 0
+        bodies = [self.call(name, CHEAP)[2] for name in ('first', 'second')]
+        status, headers, body = self.call('third', CHEAP)
+        self.assertEqual(status, '503 SERVICE UNAVAILABLE')
+        self.assertEqual(headers['Retry-After'], '1')
+        self.assertIn(b'retry', b''.join(body))
+        self.assertEqual(self.controller.rejected, 1)
+        for body in bodies:
+            list(body)      # a body that has been sent in full frees its slot
+        self.assertEqual(self.controller.active, 0)
+
+    def test_queue_timeout(self):
+        """Test that a request that waits longer than the budget is rejected."""
+        self.controller.queue_timeout = 0.01
+        bodies = [self.call(name, CHEAP)[2] for name in ('first', 'second')]
+        self.assertEqual(self.call('third', CHEAP)[0], '503 SERVICE UNAVAILABLE')
+        self.assertEqual(self.controller.queued, 0)
+        for body in bodies:
+            body.close()
+        self.assertEqual(self.controller.active, 0)
+
+    def test_cheap_requests_go_first(self):
+        """Test that expensive requests leave room for cheap ones and wait behind them."""
+        _, _, expensive = self.call('expensive', EXPENSIVE)
+        # Expensive requests may only take half the slots
+        waiting_expensive, expensive_results = self.call_in_thread('waiting expensive', EXPENSIVE)
+        self.wait_until_queued(1)
+        _, _, cheap = self.call('cheap', CHEAP)
+        waiting_cheap, cheap_results = self.call_in_thread('waiting cheap', CHEAP)
+        self.wait_until_queued(2)
+
+        cheap.close()
+        waiting_cheap.join()
+        self.assertEqual(self.started, ['expensive', 'cheap', 'waiting cheap'])
+
+        expensive.close()
+        waiting_expensive.join()
+        self.assertEqual(self.started[-1], 'waiting expensive')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,11 +1,21 @@
 import unittest
+from unittest.mock import patch
 import json
-from app import app
+import gzip
+import zlib
+import tempfile
+import logging
+from werkzeug.test import EnvironBuilder
+from app import create_app
+
+app = create_app()
 
 class PetShopTestCase(unittest.TestCase):
 
     def setUp(self):
         self.client = app.test_client()
+        self.compressor = app.extensions['petshop'].compressor
+        self.store = app.extensions['petshop'].store
         self.client.post('/pets/reset')
 
     def test_home(self):
@@ -28,6 +38,53 @@ class PetShopTestCase(unittest.TestCase):
         self.assertEqual(data['name'], "Buddy")
         self.assertEqual(data['category'], "Dog")
 
+    def test_create_pet_invalid(self):
+        """Test that a pet with badly typed fields is rejected."""
+        response = self.client.post('/pets', json={"name": "Buddy", "available": "yes"})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("available", response.get_json()['message'])
+
+        response = self.client.post('/pets', json={"name": "Buddy", "birthday": "yesterday"})
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.post('/pets', json=["Buddy"])
+        self.assertEqual(response.status_code, 400)
+
+        self.client.post('/pets', json={"name": "Buddy"})
+        response = self.client.put('/pets/1', json={"category": 7})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get('/pets').get_json(), [{"id": 1, "name": "Buddy"}])
+
+    def test_create_pets_batch(self):
+        """Test creating several pets in one request."""
+        self.client.post('/pets', json={"name": "Buddy", "category": "Dog"})
+        response = self.client.post('/pets/batch', json=[
+            {"name": "Mittens", "category": "Cat"},
+            {"name": "Rex", "category": "Dog"}
+        ])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.get_json()['ids'], [2, 3])
+
+        body = '{"name": "Nemo", "category": "Fish"}\n{"name": "Fido", "category": "Dog"}\n'
+        response = self.client.post('/pets/batch', data=body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.get_json()['ids'], [4, 5])
+
+        response = self.client.get('/pets?category=dog')
+        self.assertEqual([pet['name'] for pet in response.get_json()], ["Buddy", "Rex", "Fido"])
+
+    def test_create_pets_batch_invalid(self):
+        """Test that a malformed batch is rejected without creating pets."""
+        response = self.client.post('/pets/batch', json={"name": "Buddy"})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/pets/batch', json=[{"name": "Buddy"}, "Rex"])
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/pets/batch', data='{"name": ', content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.get('/pets')
+        self.assertEqual(response.get_json(), [])
+
     def test_get_pets_with_data(self):
         """Test getting all pets after adding some."""
         self.client.post('/pets', json={"name": "Buddy", "category": "Dog"})
@@ -40,6 +97,258 @@ class PetShopTestCase(unittest.TestCase):
         self.assertEqual(data[0]['name'], "Buddy")
         self.assertEqual(data[1]['name'], "Mittens")
 
+    def test_get_pets_paginated(self):
+        """Test walking the pet list one page at a time."""
+        for name in ["Buddy", "Mittens", "Rex", "Nemo", "Fido"]:
+            self.client.post('/pets', json={"name": name, "category": "Dog"})
+        self.client.delete('/pets/2')
+
+        response = self.client.get('/pets?limit=2')
+        self.assertEqual([pet['name'] for pet in response.get_json()], ["Buddy", "Rex"])
+        cursor = response.headers['X-Next-Cursor']
+
+        response = self.client.get(f'/pets?limit=2&cursor={cursor}')
+        self.assertEqual([pet['name'] for pet in response.get_json()], ["Nemo", "Fido"])
+        self.assertNotIn('X-Next-Cursor', response.headers)
+
+        response = self.client.get('/pets?category=dog&limit=3')
+        self.assertEqual(len(response.get_json()), 3)
+        self.assertIn('X-Next-Cursor', response.headers)
+
+    def test_get_pets_bad_page_args(self):
+        """Test that a bad limit or cursor is rejected."""
+        response = self.client.get('/pets?limit=0')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Invalid limit", response.get_json()['message'])
+
+        response = self.client.get('/pets?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Invalid cursor", response.get_json()['message'])
+
+    def test_streamed_listing_is_one_version(self):
+        """Test that a listing being streamed is not affected by later writes."""
+        self.client.post('/pets', json={"name": "Buddy", "category": "Dog"})
+        self.client.post('/pets', json={"name": "Mittens", "category": "Cat"})
+
+        response = self.client.get('/pets?stream=true')
+        self.client.put('/pets/1', json={"name": "Rex"})
+        self.client.delete('/pets/2')
+        self.assertEqual([pet['name'] for pet in response.get_json()], ["Buddy", "Mittens"])
+        self.assertEqual(int(response.headers['X-Pets-Version']) + 2,
+                         int(self.client.get('/pets').headers['X-Pets-Version']))
+
+    def test_listing_version_is_read_before_the_pets(self):
+        """Test that a pet created during a listing is either in it or in the changes after its version."""
+        self.client.post('/pets', json={"name": "Buddy"})
+        created = []
+
+        def then_create(method):
+            # Creates a pet between the search and the view, whichever comes first
+            def call(*args):
+                result = method(*args)
+                if not created:
+                    created.append(self.store.create({"name": "Rex"}))
+                return result
+            return call
+
+        with patch.object(self.store, 'find', then_create(self.store.find)), \
+                patch.object(self.store, 'read_view', then_create(self.store.read_view)):
+            response = self.client.get('/pets')
+        listed = [pet['name'] for pet in response.get_json()]
+        version, etag = response.headers['X-Pets-Version'], response.headers['ETag']
+
+        response = self.client.get(f'/pets/changes?since={version}')
+        changed = [change['pet']['name'] for change in response.get_json()['changes']]
+        self.assertEqual(listed + changed, ["Buddy", "Rex"])
+        response = self.client.get('/pets', headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([pet['name'] for pet in response.get_json()], ["Buddy", "Rex"])
+
+    def test_unread_stream_frees_its_view(self):
+        """Test that a streamed listing closed before its first chunk still closes its view."""
+        self.client.post('/pets', json={"name": "Buddy"})
+        # Called like a server whose client hangs up, since the test client reads a first chunk
+        environ = EnvironBuilder('/pets', query_string='stream=true').get_environ()
+        body = self.client.application(environ, lambda status, headers, exc_info=None: None)
+        body.close()
+        self.assertEqual(self.store._readers, {})
+
+    def test_get_pets_streamed(self):
+        """Test streaming the pet list as a JSON array and as NDJSON."""
+        response = self.client.get('/pets?stream=true')
+        self.assertEqual(response.get_json(), [])
+
+        self.client.post('/pets', json={"name": "Buddy", "category": "Dog"})
+        self.client.post('/pets', json={"name": "Mittens", "category": "Cat"})
+
+        response = self.client.get('/pets?stream=true')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([pet['name'] for pet in response.get_json()], ["Buddy", "Mittens"])
+
+        with patch('app.STREAM_CHUNK_SIZE', 1):
+            response = self.client.get('/pets?stream=true')
+            self.assertEqual([pet['name'] for pet in response.get_json()], ["Buddy", "Mittens"])
+
+            response = self.client.get('/pets', headers={'Accept': 'application/x-ndjson'})
+            self.assertEqual(response.mimetype, 'application/x-ndjson')
+            lines = response.get_data(as_text=True).splitlines()
+            self.assertEqual([json.loads(line)['name'] for line in lines], ["Buddy", "Mittens"])
+
+    def test_get_pets_not_modified(self):
+        """Test that an unchanged listing is answered with 304 Not Modified."""
+        self.client.post('/pets', json={"name": "Buddy", "category": "Dog"})
+
+        response = self.client.get('/pets')
+        etag = response.headers['ETag']
+        response = self.client.get('/pets', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers['ETag'], etag)
+
+        # A different query has its own ETag
+        response = self.client.get('/pets?category=dog', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+
+        # The query and the headers hashed into the ETag cannot run into each other
+        self.client.post('/pets', json={"name": "Rex", "category": "Dog"})
+        short = self.client.get('/pets?limit=1', headers={'Accept': '0, application/json'})
+        long = self.client.get('/pets?limit=10', headers={'Accept': ', application/json'})
+        self.assertNotEqual(short.get_json(), long.get_json())
+        self.assertNotEqual(short.headers['ETag'], long.headers['ETag'])
+
+        # Any change to the pets invalidates the ETag
+        self.client.put('/pets/1', json={"name": "Buddy Jr."})
+        response = self.client.get('/pets', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+        self.client.post('/pets/reset')
+        response = self.client.get('/pets', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+
+    def test_pet_changes(self):
+        """Test fetching only the changes made since a listing."""
+        self.client.post('/pets', json={"name": "Buddy", "category": "Dog"})
+        response = self.client.get('/pets')
+        version = int(response.headers['X-Pets-Version'])
+
+        self.client.post('/pets/batch', json=[{"name": "Rex"}, {"name": "Nemo"}])
+        self.client.put('/pets/1', json={"name": "Buddy Jr."})
+        self.client.delete('/pets/2')
+
+        response = self.client.get(f'/pets/changes?since={version}')
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertFalse(data['resync'])
+        self.assertEqual(data['version'], version + 3)
+        self.assertEqual([(change['type'], change['id']) for change in data['changes']],
+                         [('create', 2), ('create', 3), ('update', 1), ('delete', 2)])
+        self.assertEqual(data['changes'][2]['pet']['name'], "Buddy Jr.")
+        self.assertNotIn('pet', data['changes'][3])
+
+        response = self.client.get(f"/pets/changes?since={data['version']}")
+        self.assertEqual(response.get_json()['changes'], [])
+
+    def test_pet_changes_resync(self):
+        """Test that a client that cannot catch up is told to reload."""
+        self.client.post('/pets', json={"name": "Buddy"})
+        self.client.post('/pets/reset')
+        response = self.client.get('/pets/changes?since=0')
+        self.assertTrue(response.get_json()['resync'])
+
+        response = self.client.get('/pets/changes?since=123456789')
+        self.assertTrue(response.get_json()['resync'])
+
+        response = self.client.get('/pets/changes?since=abc')
+        self.assertEqual(response.status_code, 400)
+
+    @patch('app.KEEPALIVE_SECONDS', 0.01)
+    def test_pet_stream(self):
+        """Test that changes are pushed to the event stream."""
+        response = self.client.get('/pets/stream', buffered=False)
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        events = iter(response.response)
+        self.assertIn(b"event: ready", next(events))
+
+        self.client.post('/pets', json={"name": "Buddy", "category": "Dog"})
+        message = next(chunk for chunk in events if not chunk.startswith(b":"))
+        self.assertIn(b"event: create", message)
+        self.assertIn(b'"name":"Buddy"', message)
+        response.close()
+
+    def test_pet_stream_resume(self):
+        """Test that a reconnecting client first gets the changes it missed."""
+        self.client.post('/pets', json={"name": "Buddy"})
+        version = int(self.client.get('/pets').headers['X-Pets-Version'])
+        self.client.delete('/pets/1')
+
+        response = self.client.get('/pets/stream', headers={"Last-Event-ID": str(version)},
+                                   buffered=False)
+        events = iter(response.response)
+        message = next(events)
+        self.assertIn(b"event: delete", message)
+        self.assertIn(f"id: {version + 1}".encode(), message)
+        self.assertIn(b"event: ready", next(events))
+        response.close()
+
+    def test_compressed_listing(self):
+        """Test that large listings are compressed for clients that accept it."""
+        self.client.post('/pets/batch', json=[{"name": f"Pet {n}", "category": "Dog"} for n in range(100)])
+        plain = self.client.get('/pets')
+        self.assertNotIn('Content-Encoding', plain.headers)
+
+        response = self.client.get('/pets', headers={"Accept-Encoding": "gzip, deflate"})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        self.assertLess(len(response.data), len(plain.data) // 4)
+        self.assertEqual(gzip.decompress(response.data), plain.data)
+        self.assertNotEqual(response.headers['ETag'], plain.headers['ETag'])
+
+        response = self.client.get('/pets', headers={"Accept-Encoding": "deflate"})
+        self.assertEqual(response.headers['Content-Encoding'], 'deflate')
+        self.assertEqual(zlib.decompress(response.data), plain.data)
+
+        # A small body is not worth compressing
+        response = self.client.get('/pets?limit=1', headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn('Content-Encoding', response.headers)
+
+    def test_compressed_listing_is_cached(self):
+        """Test that an unchanged listing is compressed only once."""
+        self.client.post('/pets/batch', json=[{"name": f"Pet {n}"} for n in range(100)])
+        with patch.object(self.compressor, 'compress', wraps=self.compressor.compress) as compress:
+            first = self.client.get('/pets', headers={"Accept-Encoding": "gzip"})
+            second = self.client.get('/pets', headers={"Accept-Encoding": "gzip"})
+            self.assertEqual(compress.call_count, 1)
+            self.assertEqual(first.data, second.data)
+
+            self.client.post('/pets', json={"name": "Buddy"})
+            self.client.get('/pets', headers={"Accept-Encoding": "gzip"})
+            self.assertEqual(compress.call_count, 2)
+
+    @patch('app.STREAM_CHUNK_SIZE', 1)
+    def test_compressed_stream(self):
+        """Test that a streamed listing is compressed chunk by chunk."""
+        self.client.post('/pets/batch', json=[{"name": "Buddy"}, {"name": "Rex"}])
+        response = self.client.get('/pets?stream=true', headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual([pet['name'] for pet in json.loads(gzip.decompress(response.data))],
+                         ["Buddy", "Rex"])
+
+    def test_metrics(self):
+        """Test that request latencies and the store size are exposed at /metrics."""
+        response = self.client.post('/pets', json={"name": "Buddy"})
+        self.assertTrue(response.headers['Server-Timing'].startswith('app;dur='))
+        self.client.put('/pets/1', json={"name": "Rex"})
+        self.client.get('/no/such/page')
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        metrics = response.get_data(as_text=True)
+        self.assertIn('http_request_duration_seconds_count{route="/pets/<int:pet_id>",method="PUT",status="200"} ', metrics)
+        self.assertIn('http_request_duration_seconds_bucket{route="/pets",method="POST",status="201",le="+Inf"} ', metrics)
+        self.assertIn('route="unmatched",method="GET",status="404"', metrics)
+        self.assertIn('\npetshop_pets 1\n', metrics)
+        self.assertRegex(metrics, '\nhttp_requests_in_flight \\d+\n')
+
     def test_search_pets_by_category(self):
         """Test searching/filtering pets by category."""
         self.client.post('/pets', json={"name": "Buddy", "category": "Dog"})
@@ -61,6 +370,81 @@ class PetShopTestCase(unittest.TestCase):
         self.assertEqual(len(data), 1)
         self.assertEqual(data[0]['name'], "Mittens")
 
+    def test_search_pets_by_category_after_changes(self):
+        """Test that category search follows updates and deletes."""
+        self.client.post('/pets', json={"name": "Buddy", "category": "Dog"})
+        self.client.post('/pets', json={"name": "Rex", "category": "Dog"})
+        self.client.put('/pets/1', json={"category": "Cat"})
+        self.client.delete('/pets/2')
+
+        response = self.client.get('/pets?category=DOG')
+        self.assertEqual(response.get_json(), [])
+
+        response = self.client.get('/pets?category=cat')
+        data = response.get_json()
+        self.assertEqual(len(data), 1)
+        self.assertEqual(data[0]['name'], "Buddy")
+
+    def test_search_pets_by_name(self):
+        """Test exact, prefix and substring search by name."""
+        self.client.post('/pets', json={"name": "Buddy", "category": "Dog"})
+        self.client.post('/pets', json={"name": "Bubbles", "category": "Fish"})
+        self.client.post('/pets', json={"name": "Rex Buddy", "category": "Dog"})
+
+        response = self.client.get('/pets?name=buddy')
+        self.assertEqual([pet['id'] for pet in response.get_json()], [1])
+
+        response = self.client.get('/pets?name_prefix=BU')
+        self.assertEqual([pet['id'] for pet in response.get_json()], [1, 2])
+
+        response = self.client.get('/pets?name_contains=uddy')
+        self.assertEqual([pet['id'] for pet in response.get_json()], [1, 3])
+
+        response = self.client.get('/pets?name_contains=b')
+        self.assertEqual([pet['id'] for pet in response.get_json()], [1, 2, 3])
+
+        response = self.client.get('/pets?name_contains=buddy&category=fish')
+        self.assertEqual(response.get_json(), [])
+
+    def test_search_pets_by_several_fields(self):
+        """Test filtering by gender, availability and birthday, with the plan reported."""
+        self.client.post('/pets', json={"name": "Buddy", "category": "Dog", "gender": "MALE",
+                                        "available": True, "birthday": "2020-01-15"})
+        self.client.post('/pets', json={"name": "Rex", "category": "Dog", "gender": "MALE",
+                                        "available": False, "birthday": "2021-03-10"})
+        self.client.post('/pets', json={"name": "Daisy", "category": "Dog", "gender": "FEMALE",
+                                        "available": True, "birthday": "2021-06-01"})
+
+        response = self.client.get('/pets?category=dog&available=true&gender=MALE&birthday_from=2019-01-01')
+        self.assertEqual([pet['id'] for pet in response.get_json()], [1])
+        self.assertNotIn('X-Query-Plan', response.headers)
+
+        response = self.client.get('/pets?category=dog&birthday_from=2021-01-01&explain=true')
+        self.assertEqual([pet['id'] for pet in response.get_json()], [2, 3])
+        plan = json.loads(response.headers['X-Query-Plan'])
+        self.assertIn('index', plan)
+        self.assertIn('steps', plan)
+
+        response = self.client.get('/pets?available=yes')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/pets?birthday_to=2021-13-01')
+        self.assertEqual(response.status_code, 400)
+
+    def test_search_pets_by_name_after_changes(self):
+        """Test that name search follows updates and deletes."""
+        self.client.post('/pets', json={"name": "Buddy", "category": "Dog"})
+        self.client.post('/pets', json={"name": "Buddy", "category": "Dog"})
+        self.client.put('/pets/1', json={"name": "Fido"})
+        self.client.delete('/pets/2')
+
+        response = self.client.get('/pets?name_contains=budd')
+        self.assertEqual(response.get_json(), [])
+
+        response = self.client.get('/pets?name_prefix=fi')
+        data = response.get_json()
+        self.assertEqual(len(data), 1)
+        self.assertEqual(data[0]['id'], 1)
+
     def test_update_pet_success(self):
         """Test updating an existing pet."""
         self.client.post('/pets', json={"name": "Buddy", "category": "Dog"})
@@ -95,6 +479,67 @@ class PetShopTestCase(unittest.TestCase):
         self.assertEqual(response.status_code, 404)
         self.assertIn("not found", response.get_json()['message'])
 
+    def test_pet_stats(self):
+        """Test the counts per category, gender and availability."""
+        self.client.post('/pets', json={"name": "Buddy", "category": "Dog", "gender": "MALE", "available": True})
+        self.client.post('/pets', json={"name": "Mittens", "category": "Cat", "available": False})
+        self.client.put('/pets/2', json={"available": True})
+
+        response = self.client.get('/pets/stats')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), {
+            "total": 2,
+            "category": {"cat": 1, "dog": 1},
+            "gender": {"male": 1},
+            "available": {"true": 2},
+        })
+        self.assertIn('X-Pets-Version', response.headers)
+
+    def test_bulk_update_pets(self):
+        """Test updating many pets by ID or by filter in one request."""
+        for name in ("Buddy", "Rex", "Mittens"):
+            self.client.post('/pets', json={"name": name, "category": "Cat" if name == "Mittens" else "Dog"})
+
+        response = self.client.patch('/pets', json=[{"id": 1, "available": False}, {"id": 99, "name": "Ghost"}])
+        self.assertEqual(response.status_code, 200)
+        results = response.get_json()['results']
+        self.assertEqual([(result['id'], result['status']) for result in results], [(1, 200), (99, 404)])
+        self.assertEqual(results[0]['pet']['available'], False)
+
+        response = self.client.patch('/pets', json={"filter": {"category": "dog"}, "patch": {"available": True}})
+        self.assertEqual([result['id'] for result in response.get_json()['results']], [1, 2])
+        response = self.client.get('/pets?available=true')
+        self.assertEqual([pet['name'] for pet in response.get_json()], ["Buddy", "Rex"])
+
+        for body in ([{"name": "No ID"}], {"filter": {}, "patch": {}}, [{"id": 1, "available": "yes"}], "nope"):
+            response = self.client.patch('/pets', json=body)
+            self.assertEqual(response.status_code, 400)
+
+        # A filter that is empty or unknown must not match every pet
+        for filters in ({"category": ""}, {"category": None}, {"bogus": None}, {"bogus": "dog"}):
+            response = self.client.patch('/pets', json={"filter": filters, "patch": {"name": "Changed"}})
+            self.assertEqual(response.status_code, 400)
+        response = self.client.get('/pets')
+        self.assertNotIn("Changed", [pet['name'] for pet in response.get_json()])
+
+    def test_bulk_delete_pets(self):
+        """Test deleting many pets by ID or by filter in one request."""
+        for name in ("Buddy", "Rex", "Mittens", "Tom"):
+            self.client.post('/pets', json={"name": name, "category": "Cat" if name in ("Mittens", "Tom") else "Dog"})
+
+        response = self.client.delete('/pets?ids=1,99')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(result['id'], result['status']) for result in response.get_json()['results']],
+                         [(1, 204), (99, 404)])
+
+        response = self.client.delete('/pets?category=cat')
+        self.assertEqual([result['id'] for result in response.get_json()['results']], [3, 4])
+        response = self.client.get('/pets')
+        self.assertEqual([pet['name'] for pet in response.get_json()], ["Rex"])
+
+        self.assertEqual(self.client.delete('/pets').status_code, 400)
+        self.assertEqual(self.client.delete('/pets?ids=one').status_code, 400)
+
     def test_reset_pets(self):
         """Test the reset functionality."""
         self.client.post('/pets', json={"name": "Buddy", "category": "Dog"})
@@ -104,3 +549,34 @@ class PetShopTestCase(unittest.TestCase):
         
         get_response = self.client.get('/pets')
         self.assertEqual(get_response.get_json(), [])
+
+class CreateAppTestCase(unittest.TestCase):
+
+    def test_apps_have_their_own_store(self):
+        """Test that every app create_app() builds has its own store and settings."""
+        small = create_app({'PETSTORE_COMPRESS_MIN_SIZE': 1})
+        other = create_app()
+        small.test_client().post('/pets', json={"name": "Buddy"})
+
+        response = small.test_client().get('/pets', headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(response.data))[0]['name'], "Buddy")
+        self.assertEqual(other.test_client().get('/pets').get_json(), [])
+
+    def test_recovery_time_is_reported(self):
+        """Test that an app with a logged store reports how long recovery took."""
+        with tempfile.TemporaryDirectory() as directory:
+            with self.assertLogs('app', 'INFO') as logs:
+                logged = create_app({'PETSTORE_LOG_DIR': directory})
+            self.assertIn("INFO:app:Recovered 0 pets in", logs.output[0])
+            self.assertTrue(logged.logger.isEnabledFor(logging.INFO))
+            metrics = logged.test_client().get('/metrics').get_data(as_text=True)
+            self.assertRegex(metrics, '\npetshop_recovery_seconds [0-9.e-]+\n')
+            logged.extensions['petshop'].store.close()
+
+    def test_default_app_is_built_on_first_use(self):
+        """Test that importing app builds nothing until app.app is used."""
+        import app as module
+        module.__dict__.pop('app', None)
+        self.assertIsNotNone(module.app.extensions['petshop'].store)
+        self.assertIs(module.app, module.__dict__['app'])
@@ -0,0 +1,92 @@
+import asyncio
+import concurrent.futures
+import queue
+import threading
+import unittest
+from werkzeug.http import HTTP_STATUS_CODES
+from werkzeug.test import Client
+from werkzeug.wsgi import ClosingIterator
+from werkzeug.wrappers import Response
+import asgi_app
+import test_app
+
+class AsgiToWsgi:
+    """
+    Serves an ASGI application to Werkzeug's test client.
+
+    The application runs on an event loop in a thread of its own, and each
+    body chunk it sends is handed over as soon as it arrives, so streamed
+    responses can be read one chunk at a time like with Flask's client.
+    """
+
+    def __init__(self, application):
+        self.application = application
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+
+    def __call__(self, environ, start_response):
+        body = environ['wsgi.input'].read(int(environ.get('CONTENT_LENGTH') or 0))
+        headers = [(key[5:].replace('_', '-').lower().encode('latin-1'), value.encode('latin-1'))
+                   for key, value in environ.items() if key.startswith('HTTP_')]
+        if environ.get('CONTENT_TYPE'):
+            headers.append((b'content-type', environ['CONTENT_TYPE'].encode('latin-1')))
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+            'method': environ['REQUEST_METHOD'], 'scheme': 'http',
+            'path': environ['PATH_INFO'].encode('latin-1').decode(), 'root_path': '',
+            'query_string': environ.get('QUERY_STRING', '').encode('latin-1'),
+            'headers': headers, 'server': ('localhost', 80), 'client': ('127.0.0.1', 1234),
+        }
+        messages = queue.Queue()
+        disconnected = asyncio.Event()
+        requests = [{'type': 'http.request', 'body': body, 'more_body': False}]
+
+        async def receive():
+            if requests:
+                return requests.pop()
+            await disconnected.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            messages.put(message)
+
+        future = asyncio.run_coroutine_threadsafe(self.application(scope, receive, send), self.loop)
+        future.add_done_callback(lambda _: messages.put(None))
+        start = messages.get()
+        if start is None:
+            future.result()     # raises whatever the application raised
+        start_response(f"{start['status']} {HTTP_STATUS_CODES.get(start['status'], '')}",
+                       [(name.decode('latin-1'), value.decode('latin-1')) for name, value in start['headers']])
+
+        def body_chunks():
+            try:
+                while True:
+                    message = messages.get()
+                    if message is None:
+                        future.result()
+                        return
+                    if message.get('body'):
+                        yield message['body']
+            finally:
+                self.loop.call_soon_threadsafe(disconnected.set)
+
+        def close():
+            # Like a client hanging up, then waits for the application to finish
+            self.loop.call_soon_threadsafe(disconnected.set)
+            concurrent.futures.wait([future])
+        return ClosingIterator(body_chunks(), close)
+
+
+class AsgiPetShopTestCase(test_app.PetShopTestCase):
+    """Runs the whole Flask test suite against the ASGI application."""
+
+    bridge = AsgiToWsgi(asgi_app.app)
+
+    def setUp(self):
+        self.client = Client(self.bridge, Response)
+        self.compressor = asgi_app.compressor
+        self.store = asgi_app.store
+        self.client.post('/pets/reset')
+
+if __name__ == '__main__':
+    unittest.main()
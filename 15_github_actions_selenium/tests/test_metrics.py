@@ -0,0 +1,39 @@
+import unittest
+from metrics import (BUCKET_BOUNDS, BUCKET_COUNT, MAX_MICROS, MetricsMiddleware,
+                     bucket_index, bucket_upper_bound)
+
+def empty_app(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'application/json')])
+    return [b'[]']
+
+class MetricsTestCase(unittest.TestCase):
+
+    def test_buckets_cover_every_latency(self):
+        """Test that each latency falls in the bucket whose bounds contain it."""
+        for micros in list(range(200)) + [1000, 12345, 10**6, MAX_MICROS]:
+            index = bucket_index(micros)
+            lower = bucket_upper_bound(index - 1) if index else 0
+            self.assertLessEqual(lower, micros)
+            self.assertLess(micros, bucket_upper_bound(index))
+            self.assertLessEqual(bucket_upper_bound(index) - lower, max(1, micros // 4 + 1))
+        self.assertEqual(bucket_index(MAX_MICROS * 10), BUCKET_COUNT - 1)
+        self.assertEqual(len(BUCKET_BOUNDS), BUCKET_COUNT)
+
+    def test_middleware_records_requests(self):
+        """Test that a request is timed, counted and finished when its body closes."""
+        metrics = MetricsMiddleware(empty_app, gauges={'pets': lambda: 3})
+        headers = []
+        body = metrics({'REQUEST_METHOD': 'GET', 'PATH_INFO': '/pets'},
+                       lambda status, response_headers, exc_info=None: headers.extend(response_headers))
+        self.assertIn('Server-Timing', dict(headers))
+        self.assertEqual(metrics.in_flight, 1)
+        self.assertEqual(list(body), [b'[]'])
+        body.close()
+        self.assertEqual(metrics.in_flight, 0)
+
+        text = metrics.render()
+        self.assertIn('http_request_duration_seconds_count{route="unmatched",method="GET",status="200"} 1\n', text)
+        self.assertIn('\npets 3\n', text)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import sys
+import unittest
+from pet import Pet, DataValidationError
+
+class PetTestCase(unittest.TestCase):
+
+    def test_round_trip(self):
+        """Test that a pet serializes back to the dict it came from."""
+        data = {"id": 7, "name": "Buddy", "category": "dog", "gender": "MALE",
+                "available": True, "birthday": "2024-01-01", "age": 3}
+        pet = Pet.from_dict(data)
+        self.assertEqual(pet.to_dict(), data)
+        self.assertEqual(pet.birthday_ordinal, 738886)
+        self.assertEqual(repr(pet), "<Pet 'Buddy' id=[7]>")
+
+    def test_unset_fields_are_left_out(self):
+        """Test that fields a pet does not have are not serialized."""
+        pet = Pet.from_dict({"name": "Buddy", "birthday": ""})
+        self.assertEqual(pet.to_dict(), {"id": None, "name": "Buddy"})
+        self.assertFalse(hasattr(pet, '__dict__'))
+
+    def test_json_is_cached(self):
+        """Test that a pet is encoded once and an updated pet is encoded again."""
+        pet = Pet.from_dict({"id": 1, "name": "Buddy", "available": True})
+        self.assertEqual(pet.to_json(), b'{"id":1,"name":"Buddy","available":true}')
+        self.assertIs(pet.to_json(), pet.to_json())
+        self.assertEqual(pet.updated({"name": "Rex"}).to_json(), b'{"id":1,"name":"Rex","available":true}')
+
+    def test_categories_are_interned(self):
+        """Test that pets share one string per category and gender."""
+        first = Pet.from_dict({"category": "".join(["d", "og"]), "gender": "".join(["MA", "LE"])})
+        second = Pet.from_dict({"category": "".join(["do", "g"]), "gender": "".join(["M", "ALE"])})
+        self.assertIs(first.category, second.category)
+        self.assertIs(first.gender, sys.intern("MALE"))
+
+    def test_updated_returns_new_pet(self):
+        """Test that updating keeps the ID and leaves the old pet alone."""
+        pet = Pet.from_dict({"id": 1, "name": "Buddy", "color": "brown"})
+        updated = pet.updated({"id": 5, "name": "Buddy Jr.", "available": False})
+        self.assertEqual(updated.to_dict(), {"id": 1, "name": "Buddy Jr.", "available": False, "color": "brown"})
+        self.assertEqual(pet.name, "Buddy")
+        self.assertNotEqual(pet, updated)
+
+    def test_invalid_data(self):
+        """Test that badly typed fields raise DataValidationError."""
+        for data in ({"name": 5}, {"available": "true"}, {"birthday": "2024-13-01"}, ["Buddy"]):
+            with self.assertRaises(DataValidationError):
+                Pet.from_dict(data)
@@ -0,0 +1,97 @@
+import sqlite3
+import time
+import unittest
+from unittest.mock import patch
+from petevents import ChangeBroadcaster
+from petstore import PetStore
+
+class ChangeBroadcasterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.store = PetStore()
+        # A long poll interval, so only the test's own poll() calls publish
+        self.broadcaster = ChangeBroadcaster(self.store, queue_size=2, poll_interval=60)
+
+    def test_publish_changes(self):
+        """Test that every subscriber gets each change once, in order."""
+        first = self.broadcaster.subscribe()
+        second = self.broadcaster.subscribe()
+        self.assertEqual(first.version, 0)
+
+        self.store.create({"name": "Buddy"})
+        self.store.delete(1)
+        self.broadcaster.poll()
+        self.broadcaster.poll()     # nothing new
+
+        for subscription in (first, second):
+            version, message = subscription.get(0)
+            self.assertEqual(version, 1)
+            self.assertIn("event: create", message)
+            self.assertIn('"name":"Buddy"', message)
+            self.assertEqual(subscription.get(0)[0], 2)
+            self.assertIsNone(subscription.get(0))
+
+        self.broadcaster.unsubscribe(first)
+        self.assertEqual(len(self.broadcaster), 1)
+
+    def test_slow_subscriber_is_evicted(self):
+        """Test that a subscriber whose queue is full is dropped."""
+        slow = self.broadcaster.subscribe()
+        for name in ("Buddy", "Rex", "Nemo"):
+            self.store.create({"name": name})
+        self.broadcaster.poll()
+        self.assertTrue(slow.evicted)
+        self.assertEqual(len(self.broadcaster), 0)
+
+    def test_batch_is_one_message(self):
+        """Test that a batch larger than the queue reaches a subscriber as one message."""
+        subscription = self.broadcaster.subscribe()
+        self.store.create_many([{"name": f"Pet {i}"} for i in range(300)])
+        self.store.delete_many([1, 2])
+        self.broadcaster.poll()
+        self.assertFalse(subscription.evicted)
+
+        version, message = subscription.get(0)
+        self.assertEqual(version, 1)
+        self.assertEqual(message.count("event: create"), 300)
+        version, message = subscription.get(0)
+        self.assertEqual(version, 2)
+        self.assertEqual(message.count("event: delete"), 2)
+
+    def test_resync(self):
+        """Test that changes the feed no longer has turn into a resync event."""
+        subscription = self.broadcaster.subscribe()
+        self.store.create({"name": "Buddy"})
+        self.store.reset()
+        self.broadcaster.poll()
+        version, message = subscription.get(0)
+        self.assertEqual(version, 2)
+        self.assertIn("event: resync", message)
+
+    def test_failed_poll_keeps_broadcasting(self):
+        """Test that the thread outlives a failed read of the change feed."""
+        subscription = self.broadcaster.subscribe()
+        changes = self.store.changes
+        failures = [sqlite3.OperationalError("database is locked")]
+
+        def changes_failing_once(since):
+            if failures:
+                raise failures.pop()
+            return changes(since)
+
+        with patch.object(self.store, 'changes', side_effect=changes_failing_once), \
+                self.assertLogs('petevents', 'ERROR'):
+            self.store.create({"name": "Buddy"})
+            self.broadcaster.notify()
+            for _ in range(500):
+                if not failures:
+                    break
+                time.sleep(0.01)
+            self.assertIsNone(subscription.get(0))  # the failed poll published nothing
+            self.broadcaster.notify()
+            version, message = subscription.get(5)
+        self.assertEqual(version, 1)
+        self.assertIn('"name":"Buddy"', message)
+
+if __name__ == '__main__':
+    unittest.main()